@@ -0,0 +1,355 @@
+from __future__ import absolute_import
+import asyncio
+from .models import WebhookRequest
+
+
+class AsyncServer(object):
+    """Serves the webhook endpoint, the status API, the web UI and the web
+    socket feed from a single asyncio event loop. Requires aiohttp."""
+
+    def __init__(self, config, event_store, server_status, startup_event, processor):
+        import logging
+        from aiohttp import web
+
+        self._config = config
+        self._event_store = event_store
+        self._server_status = server_status
+        self._startup_event = startup_event
+        self._ws_clients = []
+        self._ws_delta_clients = set()
+        self._runners = []
+        self._loop = None
+        self._web = web
+        self.logger = logging.getLogger()
+
+        # Deploy workers run in threads of their own, started by the
+        # scheduler, so that long deploys never hold up webhook handling
+        self._processor = processor
+        self._executor = None
+
+    def run(self):
+        """Start all servers and run the event loop until stop() is called"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+
+        # Webhook requests are parsed and matched by a pool of their own
+        self._executor = ThreadPoolExecutor(max_workers=self._config['async-handler-threads'])
+
+        try:
+            self._loop.run_until_complete(self.start())
+            self._event_store.register_observer(self)
+            self._loop.run_forever()
+        finally:
+            self._event_store.unregister_observer(self)
+            self._loop.run_until_complete(self.cleanup())
+            self._loop.close()
+            self._executor.shutdown(wait=False)
+
+    def stop(self):
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def start(self):
+        import os
+        import ssl
+
+        web = self._web
+
+        app = web.Application(client_max_size=self._config['async-max-request-size'])
+        app.router.add_post('/{tail:.*}', self.handle_webhook)
+        app.router.add_get('/api/status', self.handle_status_api)
+        app.router.add_get(r'/api/events/{id:\d+}', self.handle_event_api)
+        app.router.add_get('/{tail:.*}', self.handle_static)
+
+        ssl_context = None
+        if self._config['https-enabled'] or self._config['wss-enabled']:
+            if os.path.isfile(self._config['ssl-cert']):
+                ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+                ssl_context.load_cert_chain(self._config['ssl-cert'], self._config['ssl-key'])
+
+        if self._config['http-enabled']:
+            await self.start_site(app, 'http', self._config['http-host'], self._config['http-port'])
+
+        if self._config['https-enabled']:
+            if ssl_context:
+                await self.start_site(app, 'https', self._config['https-host'], self._config['https-port'], ssl_context)
+            else:
+                self._startup_event.log_critical("Unable to activate SSL: File does not exist: %s" % self._config['ssl-cert'])
+
+        if self._config['web-ui-enabled'] and self._config['wss-enabled']:
+            if ssl_context:
+                ws_app = web.Application()
+                ws_app.router.add_get('/{tail:.*}', self.handle_web_socket)
+                await self.start_site(ws_app, 'wss', self._config['wss-host'], self._config['wss-port'], ssl_context)
+            else:
+                self._startup_event.log_critical("Unable to activate SSL: File does not exist: %s" % self._config['ssl-cert'])
+
+    async def start_site(self, app, scheme, host, port, ssl_context=None):
+        runner = self._web.AppRunner(app, access_log=None, handle_signals=False)
+        await runner.setup()
+        self._runners.append(runner)
+
+        site = self._web.TCPSite(runner, host, port, ssl_context=ssl_context,
+                                 backlog=self._config['http-backlog'])
+        try:
+            await site.start()
+        except OSError as e:
+            self._startup_event.log_critical("Unable to start %s server: %s" % (scheme.upper(), e))
+            if scheme == 'wss':
+                self._startup_event.set_ws_started(False)
+            return
+
+        port = runner.addresses[0][1] if runner.addresses else port
+        self._server_status['%s-uri' % scheme] = "%s://%s:%s" % (scheme, host, port)
+        self._startup_event.log_info("Listening for connections on %s" % self._server_status['%s-uri' % scheme])
+
+        if scheme == 'wss':
+            self._startup_event.ws_address = host
+            self._startup_event.ws_port = port
+            self._startup_event.set_ws_started(True)
+        else:
+            self._startup_event.http_address = host
+            self._startup_event.http_port = port
+            self._startup_event.set_http_started(True)
+
+    async def cleanup(self):
+        for ws in list(self._ws_clients):
+            await ws.close()
+
+        for runner in self._runners:
+            await runner.cleanup()
+
+    async def handle_webhook(self, request):
+        web = self._web
+
+        # Client needs to be whitelisted
+        if not self._processor.is_allowed_source(self.get_client_address(request)):
+            return web.Response(status=403, text="%s is not allowed access" % request.remote)
+
+        # Some requests can be ignored based on their headers alone, in which
+        # case the body is never read
+        result = self._processor.screen(self.get_client_address(request), dict(request.headers))
+        if result:
+            status, message = result
+
+            if status >= 400:
+                return web.Response(status=status, text=message)
+
+            return web.Response(status=status, content_type='text/plain')
+
+        request_body = await request.read()
+
+        # The request body is parsed at most once, and shared by all parsers and projects
+        webhook_request = WebhookRequest(self.get_client_address(request), dict(request.headers), request_body)
+
+        # Parsing and matching the request, which might also write a test
+        # case to disk, is done in the executor to keep the loop responsive
+        try:
+            status, message = await self._loop.run_in_executor(self._executor, self._processor.handle, webhook_request)
+
+        except Exception as e:
+            self.logger.exception(e)
+            return web.Response(status=500, text='Unable to process request')
+
+        if status >= 400:
+            return web.Response(status=status, text=message)
+
+        return web.Response(status=status, content_type='text/plain')
+
+    async def handle_status_api(self, request):
+        error = self.validate_web_ui(request)
+        if error:
+            return error
+
+        data = {
+            'events': self._event_store.dict_repr(self._config['web-ui-event-limit']),
+            'auth-key': self._server_status['auth-key']
+        }
+
+        data.update(self.get_server_status(request))
+        data['stats'] = self._processor.get_stats()
+        data['repositories'] = self._processor.get_repository_status()
+
+        return self._web.json_response(data, headers={'Access-Control-Allow-Origin': '*'})
+
+    async def handle_event_api(self, request):
+        error = self.validate_web_ui(request)
+        if error:
+            return error
+
+        event = self._event_store.get_event(int(request.match_info['id']))
+        if event is None:
+            return self._web.Response(status=404, text="Event not found")
+
+        return self._web.json_response(event.dict_repr(), headers={'Access-Control-Allow-Origin': '*'})
+
+    async def handle_static(self, request):
+        """Serve files from the wwwroot directory"""
+        import os
+
+        error = self.validate_web_ui(request)
+        if error:
+            return error
+
+        wwwroot = os.path.join(os.path.dirname(os.path.realpath(__file__)), "wwwroot")
+        path = os.path.realpath(os.path.join(wwwroot, request.match_info['tail']))
+
+        # Never serve files outside of wwwroot
+        if path != wwwroot and not path.startswith(wwwroot + os.sep):
+            raise self._web.HTTPNotFound()
+
+        if os.path.isdir(path):
+            path = os.path.join(path, 'index.html')
+
+        if not os.path.isfile(path):
+            raise self._web.HTTPNotFound()
+
+        return self._web.FileResponse(path, headers={'Access-Control-Allow-Origin': '*'})
+
+    async def handle_web_socket(self, request):
+        import json
+        from aiohttp import WSMsgType
+
+        ws = self._web.WebSocketResponse()
+
+        # Client needs to be whitelisted and web UI needs to be enabled
+        if not self.is_whitelisted(request) or not self._config['web-ui-enabled']:
+            self.logger.info("Unautorized connection attempt from %s" % request.remote)
+            await ws.prepare(request)
+            await ws.close()
+            return ws
+
+        await ws.prepare(request)
+        self.logger.info("Client connecting: %s" % request.remote)
+
+        try:
+            async for msg in ws:
+
+                if msg.type != WSMsgType.TEXT:
+                    continue
+
+                try:
+                    data = json.loads(msg.data)
+
+                    # Handle authentication requests
+                    if 'type' in data and data['type'] == 'authenticate':
+
+                        # Verify auth key
+                        if 'auth-key' in data and data['auth-key'] == self._server_status['auth-key']:
+
+                            # Clients may ask for change records rather than
+                            # the whole event on each change
+                            if data.get('delta-updates'):
+                                self._ws_delta_clients.add(ws)
+                            self._ws_clients.append(ws)
+                            await ws.send_str(json.dumps({"type": "authenticated"}))
+                        else:
+                            self.logger.error("Recieved bad auth key.")
+                            await ws.send_str(json.dumps({"type": "bad-auth-key"}))
+                        continue
+
+                except Exception as e:
+                    self.logger.error("Unable to interpret incoming message: %s" % e)
+
+                if ws not in self._ws_clients:
+                    self.logger.error("Recieved message form unauthenticated client, closing connection.")
+                    await ws.close()
+
+        finally:
+            if ws in self._ws_clients:
+                self._ws_clients.remove(ws)
+            self._ws_delta_clients.discard(ws)
+            self.logger.info("WebSocket connection closed.")
+
+        return ws
+
+    def update(self, *args, **kwargs):
+        """Observer callback invoked by the event store, possibly from another
+        thread. Clients not handling change records are sent the whole event
+        instead."""
+        import json
+        from .events import CHANGE_TYPES
+        data = json.dumps(kwargs)
+
+        event_data = data
+        if kwargs.get('type') in CHANGE_TYPES:
+            event_data = None
+            if len(self._ws_delta_clients) < len(self._ws_clients):
+                event_update = self._event_store.get_event_update(kwargs['id'])
+                if event_update is not None:
+                    event_data = json.dumps(event_update)
+
+        self._loop.call_soon_threadsafe(self.broadcast, data, event_data)
+
+    def broadcast(self, data, event_data):
+        for ws in list(self._ws_clients):
+            if ws.closed:
+                continue
+            if ws in self._ws_delta_clients:
+                self._loop.create_task(ws.send_str(data))
+            elif event_data is not None:
+                self._loop.create_task(ws.send_str(event_data))
+
+    def get_client_address(self, request):
+        peername = request.transport.get_extra_info('peername') if request.transport else None
+        if peername:
+            return peername[0], peername[1]
+        return request.remote, 0
+
+    def get_server_status(self, request):
+        """Generate a copy of the server status object that contains the public IP or hostname."""
+
+        public_host = request.host.split(':')[0]
+        server_status = {}
+
+        for scheme in ['http', 'https', 'wss']:
+            key = '%s-uri' % scheme
+            if key in self._server_status:
+                server_status[key] = self._server_status[key].replace(self._config['%s-host' % scheme], public_host)
+
+        return server_status
+
+    def is_whitelisted(self, request):
+
+        # Allow all if whitelist is empty
+        if self._config['web-ui-allowlist'] is None:
+            return True
+
+        return request.remote in self._config['web-ui-allowlist']
+
+    def validate_web_ui(self, request):
+        """Returns an error response if the web UI can not be served to the
+        client, otherwise None."""
+        import base64
+        web = self._web
+
+        # Web UI needs to be enabled
+        if not self._config['web-ui-enabled']:
+            return web.Response(status=403, text="Web UI is not enabled")
+
+        # Web UI might require HTTPS
+        if self._config['web-ui-require-https'] and not request.secure:
+            server_status = self.get_server_status(request)
+            if 'https-uri' in server_status:
+                raise web.HTTPTemporaryRedirect('%s%s' % (server_status['https-uri'], request.path_qs))
+            return web.Response(status=403, text="Web UI is only accessible through HTTPS")
+
+        # Client needs to be whitelisted
+        if not self.is_whitelisted(request):
+            return web.Response(status=403, text="%s is not allowed access" % request.remote)
+
+        # Client needs to authenticate
+        if not self._config['web-ui-auth-enabled']:
+            return
+
+        if self._config['web-ui-username'] is None or self._config['web-ui-password'] is None:
+            return web.Response(status=403, text="Authentication credentials missing in config")
+
+        credentials = "%s:%s" % (self._config['web-ui-username'], self._config['web-ui-password'])
+        key = base64.b64encode(credentials.encode('utf-8')).decode('utf-8')
+        if request.headers.get('Authorization') == 'Basic ' + key:
+            return
+
+        return web.Response(status=401, text='Not authenticated', headers={'WWW-Authenticate': 'Basic realm="GAD"'})
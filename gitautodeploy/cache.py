@@ -0,0 +1,65 @@
+class ExpiringCache(object):
+    """A thread safe, size bounded cache where entries expire after a fixed
+    time. When full, the least recently added entry is evicted."""
+
+    def __init__(self, size, ttl):
+        import threading
+        from collections import OrderedDict
+
+        self._size = size
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key, value=None):
+        """Adds the key to the cache unless already present. Returns True if
+        the key was added, and False if it was already present."""
+        import time
+
+        now = time.time()
+
+        with self._lock:
+            self.expire(now)
+
+            if key in self._entries:
+                return False
+
+            self._entries[key] = (now + self._ttl, value)
+
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+
+            return True
+
+    def get(self, key, default=None):
+        import time
+
+        with self._lock:
+            self.expire(time.time())
+
+            if key not in self._entries:
+                return default
+
+            return self._entries[key][1]
+
+    def set(self, key, value):
+        """Updates the value of an existing key without extending its lifetime"""
+        with self._lock:
+            if key in self._entries:
+                self._entries[key] = (self._entries[key][0], value)
+
+    def remove(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def expire(self, now):
+        """Remove expired entries. Entries are ordered by expiry time, so only
+        the oldest ones need to be checked."""
+        while self._entries:
+            key, (expires, value) = next(iter(self._entries.items()))
+            if expires > now:
+                break
+            del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
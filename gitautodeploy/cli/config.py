@@ -6,6 +6,10 @@ class ConfigFileInvalidException(Exception):
     pass
 
 
+class ConfigValueInvalidException(Exception):
+    pass
+
+
 def get_config_defaults():
     """Get the default configuration values."""
 
@@ -31,6 +35,81 @@ def get_config_defaults():
     config['http-host'] = '0.0.0.0'
     config['http-port'] = 8001
 
+    # Handle HTTP(S) requests concurrently using a fixed size pool of handler
+    # threads (0 means that requests are handled one at a time)
+    config['http-threads'] = 0
+    config['http-queue-size'] = 100  # Max number of requests waiting for a handler thread
+    config['http-backlog'] = 5  # Max number of pending connections in the socket listen queue
+    config['http-retry-after'] = 5  # Seconds to wait before retrying, sent along with 503 responses
+
+    # Server implementation; "threaded" (default) or "asyncio" (requires
+    # Python 3 and aiohttp). The asyncio engine serves HTTP, HTTPS and web
+    # socket connections from a single event loop.
+    config['server-engine'] = 'threaded'
+    config['async-max-request-size'] = 64 * 1024 * 1024  # Max size of a webhook request body in bytes
+    config['async-handler-threads'] = 8  # Number of threads parsing and matching webhook requests
+
+    # Acknowledge webhook requests with 202 Accepted as soon as they are
+    # authenticated, and match them against the configured repositories
+    # using a pool of worker threads
+    config['webhook-async-ack'] = False
+    config['webhook-intake-queue-size'] = 1000  # Max number of requests waiting to be processed
+    config['webhook-intake-workers'] = 2
+
+    # Event types (e.g. push) to accept. Requests for other events, identified
+    # by the X-GitHub-Event, X-Gitlab-Event, X-Coding-Event or X-Event-Key
+    # header, are acknowledged without being parsed. Empty means all events.
+    config['webhook-events'] = []
+
+    # Acknowledge, but do not deploy, webhook requests that are delivered
+    # more than once. Requests are identified by their X-GitHub-Delivery,
+    # X-Gitlab-Event-UUID or X-Request-UUID header, or a hash of the body.
+    config['webhook-dedup'] = False
+    config['webhook-dedup-size'] = 10000  # Max number of remembered deliveries
+    config['webhook-dedup-ttl'] = 3600  # Seconds to remember a delivery
+
+    # Clone repositories on their first deploy rather than on startup
+    config['clone-on-demand'] = False
+
+    # Directory holding a bare mirror of each remote repository. Repositories
+    # cloned from the same remote borrow the objects of its mirror, and are
+    # updated by fetching the mirror once. None disables mirrors.
+    config['mirror-dir'] = None
+
+    # Max number of deploys executed concurrently, in total and per remote
+    # host. Deploys of the same repository are always executed one at a time.
+    # A limit of 0 means unlimited.
+    config['deploy-max-workers'] = 8
+    config['deploy-max-per-host'] = 0
+
+    # Max number of bytes of output logged per deploy command and stream, by
+    # default for all repositories. Any further output is discarded. 0 means
+    # unlimited.
+    config['deploy-output-limit'] = 1024 * 1024
+
+    # Max number of seconds a single git or deploy command, and a whole deploy
+    # (pull and deploy commands), may run for, by default for all
+    # repositories. Commands running out of time are terminated along with
+    # any processes they started. 0 means unlimited.
+    config['deploy-command-timeout'] = 0
+    config['deploy-timeout'] = 0
+
+    # IP addresses or networks in CIDR notation allowed to send webhook
+    # requests, either listed or loaded from a file (one network per line, or
+    # the JSON document published at https://api.github.com/meta). Requests
+    # from other addresses are rejected before the request body is read.
+    # Empty lists allow all addresses.
+    config['webhook-whitelist'] = []
+    config['webhook-whitelist-file'] = None
+
+    # Token bucket rate limiting of webhook requests per client IP address,
+    # and of deploys per repository. Requests exceeding the limit are answered
+    # with 429 Too Many Requests. A rate of 0 disables the limit.
+    config['webhook-client-rate'] = 0  # Requests per second
+    config['webhook-client-burst'] = 10
+    config['webhook-project-rate'] = 0  # Deploys per second
+    config['webhook-project-burst'] = 5
+
     # HTTPS server options
     config['https-enabled'] = True
     config['https-host'] = '0.0.0.0'
@@ -49,10 +128,14 @@ def get_config_defaults():
     config['web-ui-enabled'] = False  # Disabled by default until authentication is in place
     config['web-ui-username'] = None
     config['web-ui-password'] = None
-    config['web-ui-whitelist'] = ['127.0.0.1']
+    config['web-ui-whitelist'] = ['127.0.0.1']  # IP addresses or networks in CIDR notation
     config['web-ui-require-https'] = True
     config['web-ui-auth-enabled'] = True
     config['web-ui-prevent-root'] = True
+    config['web-ui-event-limit'] = 100  # Max number of recent events listed by the status API
+
+    # Number of recent events kept in memory. Older events are discarded.
+    config['event-store-size'] = 100
 
     # Record all log levels by default
     config['log-level'] = 'NOTSET'
@@ -60,6 +143,8 @@ def get_config_defaults():
     # Other options
     config['intercept-stdout'] = True
     config['ssh-keyscan'] = False
+    config['ssh-keyscan-timeout'] = 5  # Seconds
+    config['ssh-known-hosts'] = '~/.ssh/known_hosts'
     config['allow-root-user'] = False
 
     # Log incoming webhook requests in a way they can be used as test cases
@@ -353,9 +438,9 @@ def init_config(config):
     import re
     import logging
     try:
-        from ..models import Project
+        from ..models import Project, ProjectIndex, PayloadFilterEngine, AddressAllowlist, normalize_url
     except ImportError:
-        from gitautodeploy.models import Project
+        from gitautodeploy.models import Project, ProjectIndex, PayloadFilterEngine, AddressAllowlist, normalize_url
 
     logger = logging.getLogger()
 
@@ -369,6 +454,10 @@ def init_config(config):
     if 'ssl-cert' in config and config['ssl-cert']:
         config['ssl-cert'] = os.path.expanduser(config['ssl-cert'])
 
+    for key in ['event-store-size', 'async-handler-threads']:
+        if not isinstance(config[key], int) or config[key] < 1:
+            raise ConfigValueInvalidException("%s must be a positive integer, got %r" % (key, config[key]))
+
     if 'ssl-key' in config and config['ssl-key']:
         config['ssl-key'] = os.path.expanduser(config['ssl-key'])
 
@@ -391,6 +480,17 @@ def init_config(config):
         if 'deploy_commands' not in repo_config:
             repo_config['deploy_commands'] = []
 
+        # Setup the output limit of deploy commands if not present
+        if 'output-limit' not in repo_config:
+            repo_config['output-limit'] = config['deploy-output-limit']
+
+        # Setup the time limits of deploys if not present
+        if 'command-timeout' not in repo_config:
+            repo_config['command-timeout'] = config['deploy-command-timeout']
+
+        if 'deploy-timeout' not in repo_config:
+            repo_config['deploy-timeout'] = config['deploy-timeout']
+
         # Check if any global pre deploy commands is specified
         if 'global_deploy' in config and len(config['global_deploy']) > 0 and len(config['global_deploy'][0]) is not 0:
             repo_config['deploy_commands'].insert(0, config['global_deploy'][0])
@@ -415,6 +515,12 @@ def init_config(config):
         if 'path' in repo_config:
             repo_config['path'] = os.path.expanduser(repo_config['path'])
 
+        # Repositories cloned from the same remote share one bare mirror,
+        # named after the canonical form of the remote URL
+        if config['mirror-dir'] and 'path' in repo_config and 'url' in repo_config and repo_config.get('mirror', True):
+            name = re.sub(r'[^a-z0-9._-]', '_', normalize_url(repo_config['url']))
+            repo_config['mirror-path'] = os.path.join(os.path.expanduser(config['mirror-dir']), name + '.git')
+
         # Support for legacy config format
         if 'filters' in repo_config:
             repo_config['payload-filter'] = repo_config['filters']
@@ -443,10 +549,44 @@ def init_config(config):
                 filter['pull_request'] = True
 
         project = Project(repo_config)
+
+        # Compile the filters right away, so that invalid patterns are
+        # reported on startup rather than when a webhook is received
+        try:
+            project.get_payload_filter_conditions()
+            project.get_header_filter_conditions()
+        except ValueError as e:
+            raise ConfigValueInvalidException("Repository %s: %s" % (repo_config.get('url', repo_config.get('path')), e))
+
         deserialized.append(project)
 
     config['repositories'] = deserialized
 
+    # Index the repositories by URL, allowing incoming webhook requests to be
+    # matched without iterating over all repositories
+    config['project-index'] = ProjectIndex(deserialized)
+
+    # Compile the payload filters of all repositories into a structure that
+    # can be evaluated in one pass
+    config['payload-filter-engine'] = PayloadFilterEngine(deserialized)
+
+    # Compile the address whitelists into structures that can be looked up
+    # by prefix. An empty whitelist (None) allows all addresses.
+    config['web-ui-allowlist'] = None
+    if config['web-ui-whitelist']:
+        config['web-ui-allowlist'] = AddressAllowlist(config['web-ui-whitelist'])
+
+    config['webhook-allowlist'] = None
+    if config['webhook-whitelist'] or config['webhook-whitelist-file']:
+        config['webhook-allowlist'] = AddressAllowlist(config['webhook-whitelist'])
+
+        # Requests are rejected rather than allowed if the file can not be read
+        if config['webhook-whitelist-file']:
+            try:
+                config['webhook-allowlist'].load(os.path.expanduser(config['webhook-whitelist-file']))
+            except (IOError, OSError) as e:
+                logger.error("Unable to load webhook whitelist: %s" % e)
+
     return config
 
 
@@ -1,7 +1,14 @@
+# Types of the change records that observers are notified of when an event
+# changes. Each record carries only what changed, along with a sequence number
+# that is increased by one for each change of the event.
+CHANGE_TYPES = ('message-appended', 'status-changed', 'field-changed')
+
+
 class SystemEvent(object):
 
     def __init__(self, name=None):
         import logging
+        import threading
 
         self.logger = logging.getLogger()
         self.hub = None
@@ -10,6 +17,8 @@ class SystemEvent(object):
         self.id = None
         self.waiting = None
         self.success = None
+        self.sequence = 0
+        self.lock = threading.Lock()
 
     def __repr__(self):
         if self.id:
@@ -23,17 +32,33 @@ class SystemEvent(object):
             "id": self.id,
             "type": type(self).__name__,
             "timestamp": time(),
-            "messages": self.messages,
+            "messages": list(self.messages),
             "waiting": self.waiting,
-            "success": self.success
+            "success": self.success,
+            "sequence": self.sequence
         }
 
     def register_hub(self, hub):
         self.hub = hub
 
     def register_message(self, message, level="INFO"):
-        self.messages.append(message)
-        self.hub.notify_observers(type="event-updated", event=self.dict_repr())
+        with self.lock:
+            self.messages.append(message)
+            self.notify_change("message-appended", message=message, level=level)
+
+    def notify_change(self, type, **delta):
+        """Notify the observers of a change record. Must be called with the
+        lock held, so that records reach observers in sequence."""
+        self.sequence = self.sequence + 1
+        self.hub.notify_observers(type=type, id=self.id, sequence=self.sequence, **delta)
+
+    def set_fields(self, type, **fields):
+        """Set attributes of the event and notify the observers of the values
+        that changed, keyed by their names in the dict representation"""
+        with self.lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.notify_change(type, fields=dict((name.replace('_', '-'), value) for name, value in fields.items()))
 
     def set_id(self, id):
         self.id = id
@@ -42,12 +67,10 @@ class SystemEvent(object):
         return self.id
 
     def set_waiting(self, value):
-        self.waiting = value
-        self.hub.notify_observers(type="event-updated", event=self.dict_repr())
+        self.set_fields("status-changed", waiting=value)
 
     def set_success(self, value):
-        self.success = value
-        self.hub.notify_observers(type="event-updated", event=self.dict_repr())
+        self.set_fields("status-changed", success=value)
         self.hub.notify_observers(type="event-success", id=self.id, success=value)
 
     def log_debug(self, message):
@@ -70,9 +93,6 @@ class SystemEvent(object):
         self.logger.critical(message)
         self.register_message(message, "CRITICAL")
 
-    #def update(self):
-    #    self.hub.notify_observers(type="event-updated", event=self.dict_repr())
-
 
 class WebhookAction(SystemEvent):
     """Represents a webhook request event and keeps a copy of all incoming and outgoing data for monitoring purposes."""
@@ -99,6 +119,8 @@ class DeployEvent(SystemEvent):
 
     def __init__(self, project):
         self.project = project
+        self.superseded = False
+        self.timed_out = False
         super(DeployEvent, self).__init__()
 
     def __repr__(self):
@@ -107,8 +129,16 @@ class DeployEvent(SystemEvent):
     def dict_repr(self):
         data = super(DeployEvent, self).dict_repr()
         data['name'] = self.project.get_name()
+        data['superseded'] = self.superseded
+        data['timed-out'] = self.timed_out
         return data
 
+    def set_superseded(self, value):
+        self.set_fields("field-changed", superseded=value)
+
+    def set_timed_out(self, value):
+        self.set_fields("field-changed", timed_out=value)
+
 
 class StartupEvent(SystemEvent):
 
@@ -136,13 +166,11 @@ class StartupEvent(SystemEvent):
         return data
 
     def set_http_started(self, value):
-        self.http_started = value
-        self.hub.notify_observers(type="event-updated", event=self.dict_repr())
+        self.set_fields("field-changed", http_address=self.http_address, http_port=self.http_port, http_started=value)
         self.validate_success()
 
     def set_ws_started(self, value):
-        self.ws_started = value
-        self.hub.notify_observers(type="event-updated", event=self.dict_repr())
+        self.set_fields("field-changed", ws_address=self.ws_address, ws_port=self.ws_port, ws_started=value)
         self.validate_success()
 
     def validate_success(self):
@@ -152,36 +180,95 @@ class StartupEvent(SystemEvent):
 
 
 class EventStore(object):
+    """Keeps the most recent events in a ring buffer of fixed capacity. Since
+    event ids are assigned in sequence, the slot of an event is given by its
+    id, so registering an event (evicting the oldest one) and looking up an
+    event by id are both constant time operations."""
+
+    def __init__(self, capacity=100):
+        import threading
+
+        if capacity < 1:
+            raise ValueError("Event store capacity must be at least 1")
 
-    def __init__(self):
-        self.actions = []
         self.observers = []
         self.next_id = 0
+        self.first_id = 0  # Id of the oldest stored event
+        self.lock = threading.Lock()
+        self.capacity = capacity
+        self.events = [None] * capacity
+
+    def set_capacity(self, capacity):
+        """Resize the buffer, keeping the most recent events"""
+        if capacity < 1:
+            raise ValueError("Event store capacity must be at least 1")
+
+        with self.lock:
+            events = self.get_events_locked()
+            self.capacity = capacity
+            self.events = [None] * capacity
+            self.first_id = max(self.first_id, self.next_id - capacity)
+            for event in events[-capacity:]:
+                self.events[event.id % capacity] = event
 
     def register_observer(self, observer):
-        self.observers.append(observer)
+        with self.lock:
+            self.observers = self.observers + [observer]
 
     def unregister_observer(self, observer):
-        if observer in self.observers:
-            self.observers.remove(observer)
+        with self.lock:
+            self.observers = [item for item in self.observers if item is not observer]
 
     def notify_observers(self, *args, **kwargs):
         for observer in self.observers:
             observer.update(*args, **kwargs)
 
+    def get_event_update(self, id):
+        """Returns a notification holding the whole event, for observers that
+        do not handle change records, or None if the event has been evicted"""
+        event = self.get_event(id)
+        if event is None:
+            return None
+        return {'type': 'event-updated', 'event': event.dict_repr()}
+
     def register_action(self, event):
-        event.set_id(self.next_id)
-        event.register_hub(self)
-        self.next_id = self.next_id + 1
-        self.actions.append(event)
-        self.notify_observers(type="new-event", event=event.dict_repr())
 
-        # Store max 100 actions
-        if len(self.actions) > 100:
-            self.actions.pop(0)
+        # Events may be registered by several request handler threads at once
+        with self.lock:
+            event.set_id(self.next_id)
+            event.register_hub(self)
+            self.next_id = self.next_id + 1
 
-    def dict_repr(self):
+            # Replaces the oldest event once the buffer is full
+            self.events[event.id % self.capacity] = event
+            self.first_id = max(self.first_id, self.next_id - self.capacity)
+
+        self.notify_observers(type="new-event", event=event.dict_repr())
+
+    def get_event(self, id):
+        """Returns the event with the given id, or None if it is unknown or
+        has been evicted"""
+        with self.lock:
+            if id < self.first_id or id >= self.next_id:
+                return None
+            return self.events[id % self.capacity]
+
+    def get_events(self, limit=None):
+        """Returns a snapshot of the stored events, oldest first, optionally
+        limited to the most recent ones"""
+        with self.lock:
+            return self.get_events_locked(limit)
+
+    def get_events_locked(self, limit=None):
+        """Must be called with the lock held"""
+        count = self.next_id - self.first_id
+        if limit is not None:
+            count = min(count, limit)
+
+        return [self.events[id % self.capacity] for id in range(self.next_id - count, self.next_id)]
+
+    def dict_repr(self, limit=None):
         action_repr = []
-        for action in self.actions:
+        for action in self.get_events(limit):
             action_repr.append(action.dict_repr())
         return action_repr
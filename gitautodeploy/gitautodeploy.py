@@ -22,7 +22,7 @@ class LogInterface(object):
 
 
 from .wsserver import WebSocketClientHandlerFactory
-from .httpserver import WebhookRequestHandlerFactory
+from .httpserver import WebhookRequestHandlerFactory, HTTPServerFactory
 
 
 class GitAutoDeploy(object):
@@ -39,6 +39,8 @@ class GitAutoDeploy(object):
     _startup_event = None
     _ws_clients = []
     _http_port = None
+    _async_server = None
+    _webhook_processor = None
 
     def __new__(cls, *args, **kwargs):
         """Overload constructor to enable singleton access"""
@@ -60,12 +62,13 @@ class GitAutoDeploy(object):
         self._event_store.register_action(self._startup_event)
 
     def clone_all_repos(self):
-        """Iterates over all configured repositories and clones them to their
-        configured paths."""
+        """Iterates over all configured repositories and schedules them to be
+        cloned to their configured paths. Repositories are cloned in
+        parallel by the deploy scheduler, while webhook requests are being
+        served. Deploys of a repository wait until it has been cloned."""
         import os
         import re
         import logging
-        from .wrappers import GitWrapper
         logger = logging.getLogger()
 
         if 'repositories' not in self._config:
@@ -85,34 +88,52 @@ class GitAutoDeploy(object):
                 logger.debug("Repository %s will not be cloned (no path configured)" % repo_config['url'])
                 continue
 
-            if os.path.isdir(repo_config['path']) and os.path.isdir(repo_config['path']+'/.git'):
-                GitWrapper.init(repo_config)
-            else:
-                GitWrapper.clone(repo_config)
+            cloned = os.path.isdir(repo_config['path']) and os.path.isdir(repo_config['path']+'/.git')
+
+            # Repositories that are cloned on demand are left untouched until
+            # their first deploy
+            if self._config['clone-on-demand']:
+                repo_config.state = 'ready' if cloned else 'not-cloned'
+                continue
+
+            repo_config.state = 'pending'
+            self._webhook_processor.schedule(repo_config, repo_config.prepare)
 
     def ssh_key_scan(self):
-        import re
+        """Scan the ssh host keys of all hosts that repositories are fetched
+        from, and add them to the known_hosts file. Each host is scanned
+        once, and only if it is not already present in the file."""
         import logging
-        from .wrappers import ProcessWrapper
+        from .knownhosts import get_ssh_host, format_host, KnownHostsFile, scan_host_keys
         logger = logging.getLogger()
 
+        known_hosts = KnownHostsFile(self._config['ssh-known-hosts'])
+
+        hosts = []
         for repository in self._config['repositories']:
 
             if 'url' not in repository:
                 continue
 
-            logger.info("Scanning repository: %s" % repository['url'])
-            m = re.match('[^\@]+\@([^\:\/]+)(:(\d+))?', repository['url'])
+            host = get_ssh_host(repository['url'])
 
-            if m is not None:
-                host = m.group(1)
-                port = m.group(3)
-                port_arg = '' if port is None else ('-p %s ' % port)
-                cmd = 'ssh-keyscan %s%s >> $HOME/.ssh/known_hosts' % (port_arg, host)
-                ProcessWrapper().call([cmd], shell=True)
+            if host is None:
+                logger.debug('Repository %s is not fetched using ssh' % repository['url'])
+                continue
 
-            else:
-                logger.error('Could not find regexp match in path: %s' % repository['url'])
+            if host not in hosts and not known_hosts.contains(*host):
+                hosts.append(host)
+
+        if not hosts:
+            return
+
+        logger.info("Scanning hosts: %s" % ', '.join(format_host(*host) for host in hosts))
+        lines = scan_host_keys(hosts, self._config['ssh-keyscan-timeout'])
+        known_hosts.add(lines)
+
+        for host in hosts:
+            if not known_hosts.contains(*host):
+                logger.error('Unable to scan host keys of %s' % format_host(*host))
 
     def create_pid_file(self):
         import os
@@ -169,9 +190,24 @@ class GitAutoDeploy(object):
 
     def update(self, *args, **kwargs):
         import json
+        from .events import CHANGE_TYPES
         data = json.dumps(kwargs).encode('utf-8')
-        for client in self._ws_clients:
-            client.sendMessage(data)
+        event_data = None
+
+        for client in list(self._ws_clients):
+
+            if kwargs.get('type') not in CHANGE_TYPES or getattr(client, 'delta_updates', False):
+                client.sendMessage(data)
+                continue
+
+            # Clients not handling change records are sent the whole event
+            if event_data is None:
+                event_update = self._event_store.get_event_update(kwargs['id'])
+                if event_update is None:
+                    continue
+                event_data = json.dumps(event_update).encode('utf-8')
+
+            client.sendMessage(event_data)
 
     def get_log_formatter(self):
         import logging
@@ -204,6 +240,7 @@ class GitAutoDeploy(object):
         import logging
         import base64
         from .lock import Lock
+        from .webhook import WebhookRequestProcessor
         import getpass
 
         # This solves https://github.com/olipo186/Git-Auto-Deploy/issues/118
@@ -219,6 +256,9 @@ class GitAutoDeploy(object):
         # Attatch config values to this instance
         self._config = config
 
+        # Keep the configured number of events in memory
+        self._event_store.set_capacity(self._config['event-store-size'])
+
         # Set up logging
         logger = logging.getLogger()
         logFormatter = self.get_log_formatter()
@@ -254,9 +294,6 @@ class GitAutoDeploy(object):
             self._startup_event.log_info('Scanning repository hosts for ssh keys...')
             self.ssh_key_scan()
 
-        # Clone all repos once initially
-        self.clone_all_repos()
-
         # Set default stdout and stderr to our logging interface (that writes
         # to file and console depending on user preference)
         if 'intercept-stdout' in self._config and self._config['intercept-stdout']:
@@ -273,9 +310,9 @@ class GitAutoDeploy(object):
         self.create_pid_file()
 
         # Generate auth key to protect the web socket server
-        self._server_status['auth-key'] = base64.b64encode(os.urandom(32))
+        self._server_status['auth-key'] = base64.b64encode(os.urandom(32)).decode('utf-8')
 
-        # Clear any existing lock files, with no regard to possible ongoing processes
+        # Clear any lock files left behind by earlier versions, with no regard to possible ongoing processes
         for repo_config in self._config['repositories']:
 
             # Do we have a physical repository?
@@ -283,6 +320,13 @@ class GitAutoDeploy(object):
                 Lock(os.path.join(repo_config['path'], 'status_running')).clear()
                 Lock(os.path.join(repo_config['path'], 'status_waiting')).clear()
 
+        # Shared by all servers. Created after forking into daemon mode since
+        # it might start worker threads.
+        self._webhook_processor = WebhookRequestProcessor(self._config, self._event_store)
+
+        # Clone all repos once initially
+        self.clone_all_repos()
+
         #if 'daemon-mode' not in self._config or not self._config['daemon-mode']:
         #    self._startup_event.log_info('Git Auto Deploy started')
 
@@ -293,11 +337,6 @@ class GitAutoDeploy(object):
         import os
         from .events import SystemEvent
 
-        try:
-            from BaseHTTPServer import HTTPServer
-        except ImportError as e:
-            from http.server import HTTPServer
-
         if not self._config['http-enabled']:
             return
 
@@ -305,12 +344,13 @@ class GitAutoDeploy(object):
         try:
 
             # Create web hook request handler class
-            WebhookRequestHandler = WebhookRequestHandlerFactory(self._config, self._event_store, self._server_status, is_https=False)
+            WebhookRequestHandler = WebhookRequestHandlerFactory(self._config, self._event_store, self._server_status, is_https=False, processor=self._webhook_processor)
 
             # Create HTTP server
-            self._http_server = HTTPServer((self._config['http-host'],
-                                       self._config['http-port']),
-                                      WebhookRequestHandler)
+            self._http_server = HTTPServerFactory(self._config,
+                                               (self._config['http-host'],
+                                                self._config['http-port']),
+                                               WebhookRequestHandler)
 
             # Setup SSL for HTTP server
             sa = self._http_server.socket.getsockname()
@@ -321,6 +361,9 @@ class GitAutoDeploy(object):
             self._startup_event.http_port = sa[1]
             self._startup_event.set_http_started(True)
 
+            if self._config['http-threads'] > 0:
+                self._startup_event.log_info("Handling HTTP requests using %s threads" % self._config['http-threads'])
+
         except socket.error as e:
             self._startup_event.log_critical("Unable to start HTTP server: %s" % e)
             return
@@ -357,11 +400,6 @@ class GitAutoDeploy(object):
         import ssl
         from .events import SystemEvent
 
-        try:
-            from BaseHTTPServer import HTTPServer
-        except ImportError as e:
-            from http.server import HTTPServer
-
         if not self._config['https-enabled']:
             return
 
@@ -373,19 +411,24 @@ class GitAutoDeploy(object):
         try:
 
             # Create web hook request handler class
-            WebhookRequestHandler = WebhookRequestHandlerFactory(self._config, self._event_store, self._server_status, is_https=True)
+            WebhookRequestHandler = WebhookRequestHandlerFactory(self._config, self._event_store, self._server_status, is_https=True, processor=self._webhook_processor)
 
             # Create HTTP server
-            self._https_server = HTTPServer((self._config['https-host'],
-                                       self._config['https-port']),
-                                      WebhookRequestHandler)
-
-            # Setup SSL for HTTP server
+            self._https_server = HTTPServerFactory(self._config,
+                                               (self._config['https-host'],
+                                                self._config['https-port']),
+                                               WebhookRequestHandler)
+
+            # Setup SSL for HTTP server. With a pool of handler threads, the
+            # handshake is done by the handler thread rather than when the
+            # connection is accepted, so that a slow client can not hold up
+            # the server.
             self._https_server_unwrapped_socket = self._https_server.socket
             self._https_server.socket = ssl.wrap_socket(self._https_server.socket,
                                                 keyfile=self._config['ssl-key'],
                                                 certfile=self._config['ssl-cert'],
-                                                server_side=True)
+                                                server_side=True,
+                                                do_handshake_on_connect=self._config['http-threads'] <= 0)
 
             sa = self._https_server.socket.getsockname()
             self._http_port = sa[1]
@@ -481,6 +524,27 @@ class GitAutoDeploy(object):
         self._event_store.register_action(event)
         event.log_info('WSS server did quit')
 
+    def serve_async(self):
+        """Start HTTP, HTTPS and web socket servers on a single asyncio event loop."""
+        from .events import SystemEvent
+
+        try:
+            from .aioserver import AsyncServer
+
+            self._async_server = AsyncServer(self._config, self._event_store, self._server_status, self._startup_event, self._webhook_processor)
+
+        except (ImportError, SyntaxError):
+            self._startup_event.log_error("Unable to start asyncio server due to missing dependency (requires Python 3 and aiohttp). Falling back to threaded servers.")
+            self._config['server-engine'] = 'threaded'
+            self.serve_forever()
+            return
+
+        self._async_server.run()
+
+        event = SystemEvent()
+        self._event_store.register_action(event)
+        event.log_info('Asyncio server did quit')
+
     def serve_forever(self):
         """Start HTTP and web socket servers."""
         import sys
@@ -510,16 +574,32 @@ class GitAutoDeploy(object):
         wwwroot = os.path.join(os.path.dirname(os.path.realpath(__file__)), "wwwroot")
         os.chdir(wwwroot)
 
-        threads = [
-            # HTTP server
-            threading.Thread(target=self.serve_http),
+        if self._config['server-engine'] == 'asyncio':
 
-            # HTTPS server
-            threading.Thread(target=self.serve_https),
+            # The web socket server is served by the same event loop, and only
+            # expected to be started if enabled
+            if self._config['web-ui-enabled'] and self._config['wss-enabled']:
+                self._startup_event.ws_started = False
+            else:
+                self._startup_event.ws_started = None
 
-            # Web socket SSL server
-            threading.Thread(target=self.serve_wss)
-        ]
+            threads = [
+                # HTTP, HTTPS and web socket servers
+                threading.Thread(target=self.serve_async)
+            ]
+
+        else:
+
+            threads = [
+                # HTTP server
+                threading.Thread(target=self.serve_http),
+
+                # HTTPS server
+                threading.Thread(target=self.serve_https),
+
+                # Web socket SSL server
+                threading.Thread(target=self.serve_wss)
+            ]
 
         # Start all threads
         for thread in threads:
@@ -563,8 +643,8 @@ class GitAutoDeploy(object):
             # Shut down the underlying TCP server
             self._http_server.shutdown()
 
-            # Close the socket
-            self._http_server.socket.close()
+            # Close the socket and stop any handler threads
+            self._http_server.server_close()
 
         # Stop HTTPS server if running
         if self._https_server is not None:
@@ -572,13 +652,21 @@ class GitAutoDeploy(object):
             # Shut down the underlying TCP server
             self._https_server.shutdown()
 
-            # Close the socket
-            self._https_server.socket.close()
+            # Close the socket and stop any handler threads
+            self._https_server.server_close()
 
         if self._https_server_unwrapped_socket is not None:
 
             self._https_server_unwrapped_socket.close()
 
+        # Stop any worker threads processing queued webhook requests
+        if self._webhook_processor is not None:
+            self._webhook_processor.stop()
+
+        # Stop asyncio server if running
+        if self._async_server is not None:
+            self._async_server.stop()
+
         # Stop web socket server if running
         try:
             from twisted.internet import reactor
@@ -608,7 +696,7 @@ def main():
     from cli.config import get_config_from_argv, find_config_file
     from cli.config import get_config_from_file, get_repo_config_from_environment
     from cli.config import init_config, get_config_file_path, rename_legacy_attribute_names
-    from cli.config import ConfigFileNotFoundException, ConfigFileInvalidException
+    from cli.config import ConfigFileNotFoundException, ConfigFileInvalidException, ConfigValueInvalidException
     import logging
     import sys
     import os
@@ -673,7 +761,12 @@ def main():
         config['repositories'].append(repo_config)
 
     # Initialize config by expanding with missing values
-    init_config(config)
+    try:
+        init_config(config)
+    except ConfigValueInvalidException as e:
+        app.setup_console_logger()
+        logger.critical("Invalid config: %s" % e)
+        return
 
     app.setup(config)
     app.serve_forever()
@@ -1,15 +1,189 @@
 from __future__ import absolute_import
-from .events import WebhookAction
-from .parsers import get_service_handler
+from .webhook import WebhookRequestProcessor
+from .models import WebhookRequest
+
+try:
+    from BaseHTTPServer import HTTPServer
+except ImportError:
+    from http.server import HTTPServer
+
+
+class ThreadPoolHTTPServer(HTTPServer, object):
+    """HTTP server that hands accepted connections over to a fixed size pool
+    of handler threads, allowing slow clients and slow requests to be handled
+    concurrently. Connections that can not be queued are rejected with a
+    503 Service Unavailable response."""
+
+    def __init__(self, server_address, RequestHandlerClass, threads=8, queue_size=100, backlog=5, retry_after=5):
+        import threading
+        try:
+            from Queue import Queue
+        except ImportError:
+            from queue import Queue
+
+        # Used by server_activate() when calling listen() on the socket
+        self.request_queue_size = backlog
+
+        self._queue = Queue(queue_size)
+        self._retry_after = retry_after
+        self._workers = []
+        self._stopped = False
+
+        HTTPServer.__init__(self, server_address, RequestHandlerClass)
+
+        for index in range(threads):
+            worker = threading.Thread(target=self.process_queue, name="http-handler-%s" % index)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def process_request(self, request, client_address):
+        """Queue the request for one of the handler threads"""
+        try:
+            from Queue import Full
+        except ImportError:
+            from queue import Full
+
+        if self._stopped:
+            self.shutdown_request(request)
+            return
+
+        try:
+            self._queue.put_nowait((request, client_address))
+        except Full:
+            self.reject_request(request, client_address)
+
+    def reject_request(self, request, client_address):
+        """Let the client know that the server is busy and close the connection"""
+        import socket
+        import logging
+        logger = logging.getLogger()
+
+        logger.warning("Request queue is full, rejecting request from %s" % client_address[0])
+
+        response = "HTTP/1.0 503 Service Unavailable\r\n" \
+                   "Retry-After: %s\r\n" \
+                   "Content-Length: 0\r\n" \
+                   "Connection: close\r\n\r\n" % self._retry_after
+
+        try:
+            request.sendall(response.encode('utf-8'))
+        except socket.error:
+            pass
+
+        self.shutdown_request(request)
+
+    def process_queue(self):
+        """Handle queued requests until a stop signal (None) is received"""
+        while True:
+            item = self._queue.get()
+
+            if item is None:
+                # Pass the stop signal on, in case the queue is smaller than
+                # the number of handler threads
+                self.put_stop_signal()
+                return
+
+            request, client_address = item
+            try:
+                if self.handshake_request(request, client_address):
+                    self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def handshake_request(self, request, client_address):
+        """Perform the TLS handshake of a connection accepted by a socket
+        wrapped with do_handshake_on_connect=False. Returns False if the
+        handshake failed."""
+        import ssl
+        import socket
+        import logging
+
+        if not isinstance(request, ssl.SSLSocket):
+            return True
+
+        try:
+            request.do_handshake()
+        except (ssl.SSLError, socket.error) as e:
+            logging.getLogger().info("TLS handshake with %s failed: %s" % (client_address[0], e))
+            return False
+
+        return True
+
+    def get_queue_size(self):
+        return self._queue.qsize()
+
+    def put_stop_signal(self):
+        try:
+            from Queue import Full
+        except ImportError:
+            from queue import Full
+
+        try:
+            self._queue.put_nowait(None)
+        except Full:
+            pass
+
+    def server_close(self):
+        try:
+            from Queue import Empty
+        except ImportError:
+            from queue import Empty
+
+        self._stopped = True
+        HTTPServer.server_close(self)
+
+        # Close any queued connections, so that the stop signal always fits
+        # in the queue
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except Empty:
+                break
+
+            if item is not None:
+                self.shutdown_request(item[0])
+
+        # Stop all handler threads
+        self.put_stop_signal()
+
+
+def HTTPServerFactory(config, server_address, RequestHandlerClass):
+    """Creates a HTTP server that handles requests either one at a time or
+    concurrently using a pool of handler threads, depending on config."""
 
+    if config['http-threads'] > 0:
+        return ThreadPoolHTTPServer(server_address, RequestHandlerClass,
+                                    threads=config['http-threads'],
+                                    queue_size=config['http-queue-size'],
+                                    backlog=config['http-backlog'],
+                                    retry_after=config['http-retry-after'])
 
-def WebhookRequestHandlerFactory(config, event_store, server_status, is_https=False):
+    server = HTTPServer(server_address, RequestHandlerClass, bind_and_activate=False)
+    server.request_queue_size = config['http-backlog']
+
+    try:
+        server.server_bind()
+        server.server_activate()
+    except Exception:
+        server.server_close()
+        raise
+
+    return server
+
+
+def WebhookRequestHandlerFactory(config, event_store, server_status, is_https=False, processor=None):
     """Factory method for webhook request handler class"""
     try:
         from SimpleHTTPServer import SimpleHTTPRequestHandler
     except ImportError as e:
         from http.server import SimpleHTTPRequestHandler
 
+    if processor is None:
+        processor = WebhookRequestProcessor(config, event_store)
+
     class WebhookRequestHandler(SimpleHTTPRequestHandler, object):
         """Extends the BaseHTTPRequestHandler class and handles the incoming
         HTTP requests."""
@@ -46,6 +220,7 @@ def WebhookRequestHandlerFactory(config, event_store, server_status, is_https=Fa
             return SimpleHTTPRequestHandler.do_HEAD(self)
 
         def do_GET(self):
+            import re
 
             # Web UI needs to be enabled
             if not self.validate_web_ui_enabled():
@@ -68,6 +243,12 @@ def WebhookRequestHandlerFactory(config, event_store, server_status, is_https=Fa
                 self.handle_status_api()
                 return
 
+            # Handle event API call
+            match = re.match(r'^/api/events/(\d+)$', self.path)
+            if match:
+                self.handle_event_api(int(match.group(1)))
+                return
+
             # Serve static file
             return SimpleHTTPRequestHandler.do_GET(self)
 
@@ -77,160 +258,85 @@ def WebhookRequestHandlerFactory(config, event_store, server_status, is_https=Fa
             from base64 import b64encode
 
             data = {
-                'events': self._event_store.dict_repr(),
+                'events': self._event_store.dict_repr(config['web-ui-event-limit']),
                 'auth-key': self._server_status['auth-key']
             }
 
             data.update(self.get_server_status())
+            data['stats'] = processor.get_stats()
+            data['repositories'] = processor.get_repository_status()
 
             self.send_response(200, 'OK')
             self.send_header('Content-type', 'application/json')
             self.end_headers()
             self.wfile.write(json.dumps(data).encode('utf-8'))
 
-        def do_POST(self):
-            """Invoked on incoming POST requests"""
-            from threading import Timer
-            import logging
+        def handle_event_api(self, id):
             import json
-            import threading
-            try:
-                from urlparse import parse_qs
-            except ModuleNotFoundError:
-                from urllib.parse import parse_qs
-
-            logger = logging.getLogger()
-
-            content_length = int(self.headers.get('content-length'))
-            request_body = self.rfile.read(content_length).decode('utf-8')
-
-            # Extract request headers and make all keys to lowercase (makes them easier to compare)
-            request_headers = dict(self.headers)
-            request_headers = dict((k.lower(), v) for k, v in request_headers.items())
-
-            action = WebhookAction(self.client_address, request_headers, request_body)
-            self._event_store.register_action(action)
-            action.set_waiting(True)
-
-            action.log_info('Incoming request from %s:%s' % (self.client_address[0], self.client_address[1]))
-
-            # Payloads from GitHub can be delivered as form data. Test the request for this pattern and extract json payload
-            if request_headers['content-type'] == 'application/x-www-form-urlencoded':
-                res = parse_qs(request_body.decode('utf-8'))
-                if 'payload' in res and len(res['payload']) == 1:
-                    request_body = res['payload'][0]
-
-            # Test case debug data
-            test_case = {
-                'headers': dict(self.headers),
-                'payload': json.loads(request_body),
-                'config': {},
-                'expected': {'status': 200, 'data': [{'deploy': 0}]}
-            }
 
-            try:
-
-                # Will raise a ValueError exception if it fails
-                ServiceRequestHandler = get_service_handler(request_headers, request_body, action)
-
-                # Unable to identify the source of the request
-                if not ServiceRequestHandler:
-                    self.send_error(400, 'Unrecognized service')
-                    test_case['expected']['status'] = 400
-                    action.log_error("Unable to find appropriate handler for request. The source service is not supported")
-                    action.set_waiting(False)
-                    action.set_success(False)
-                    return
-
-                service_handler = ServiceRequestHandler(self._config)
-
-                action.log_info("Handling the request with %s" % ServiceRequestHandler.__name__)
-
-                # Could be GitHubParser, GitLabParser or other
-                projects = service_handler.get_matching_projects(request_headers, request_body, action)
-
-                action.log_info("%s candidates matches the request" % len(projects))
+            event = self._event_store.get_event(id)
+            if event is None:
+                self.send_error(404, "Event %s not found" % id)
+                return
 
-                # request_filter = WebhookRequestFilter()
+            self.send_response(200, 'OK')
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps(event.dict_repr()).encode('utf-8'))
 
-                if len(projects) == 0:
-                    self.send_error(400, 'Bad request')
-                    test_case['expected']['status'] = 400
-                    action.log_error("No matching projects")
-                    action.set_waiting(False)
-                    action.set_success(False)
-                    return
+        def do_POST(self):
+            """Invoked on incoming POST requests"""
 
-                # Apply filters
-                matching_projects = []
-                for project in projects:
-                    if project.apply_filters(request_headers, request_body, action):
-                        matching_projects.append(project)
+            # Client needs to be whitelisted
+            if not processor.is_allowed_source(self.client_address):
+                self.send_error(403, "%s is not allowed access" % self.client_address[0])
+                return
 
-                # Only keep projects that matches
-                projects = matching_projects
+            content_length = int(self.headers.get('content-length'))
 
-                action.log_info("%s candidates matches after applying filters" % len(projects))
+            # Some requests can be ignored based on their headers alone
+            result = processor.screen(self.client_address, dict(self.headers))
+            if result:
+                self.discard_body(content_length)
+                status, message = result
 
-                if not service_handler.validate_request(request_headers, request_body, projects, action):
-                    self.send_error(400, 'Bad request')
-                    test_case['expected']['status'] = 400
-                    action.log_warning("Request was rejected due to a secret token mismatch")
-                    action.set_waiting(False)
-                    action.set_success(False)
+                if status >= 400:
+                    self.send_error(status, message)
                     return
 
-                test_case['expected']['status'] = 200
-
-                self.send_response(200, 'OK')
+                self.send_response(status, message)
                 self.send_header('Content-type', 'text/plain')
                 self.end_headers()
+                return
 
-                if len(projects) == 0:
-                    action.set_waiting(False)
-                    action.set_success(False)
-                    return
+            request_body = self.rfile.read(content_length)
 
-                action.log_info("Proceeding with %s candidates" % len(projects))
-                action.set_waiting(False)
-                action.set_success(True)
-
-                for project in projects:
-
-                    # Schedule the execution of the webhook (git pull and trigger deploy etc)
-                    thread = threading.Thread(target=project.execute_webhook, args=[self._event_store])
-                    thread.start()
-
-                    # Add additional test case data
-                    test_case['config'] = {
-                        'url': 'url' in project and project['url'],
-                        'branch': 'branch' in project and project['branch'],
-                        'remote': 'remote' in project and project['remote'],
-                        'deploy': 'echo test!'
-                    }
-
-            except ValueError as e:
-                self.send_error(400, 'Unprocessable request')
-                action.log_warning('Unable to process incoming request from %s:%s' % (self.client_address[0], self.client_address[1]))
-                test_case['expected']['status'] = 400
-                action.set_waiting(False)
-                action.set_success(False)
-                return
+            # The request body is parsed at most once, and shared by all parsers and projects
+            request = WebhookRequest(self.client_address, dict(self.headers), request_body)
+
+            try:
+                status, message = processor.handle(request)
 
             except Exception as e:
                 self.send_error(500, 'Unable to process request')
-                test_case['expected']['status'] = 500
-                action.log_warning("Unable to process request")
-                action.set_waiting(False)
-                action.set_success(False)
-
                 raise e
 
-            finally:
+            if status >= 400:
+                self.send_error(status, message)
+                return
+
+            self.send_response(status, message)
+            self.send_header('Content-type', 'text/plain')
+            self.end_headers()
 
-                # Save the request as a test case
-                if 'log-test-case' in self._config and self._config['log-test-case']:
-                    self.save_test_case(test_case)
+        def discard_body(self, content_length):
+            """Read and throw away the request body in chunks, to avoid
+            resetting the connection before the client has read the response"""
+            while content_length > 0:
+                chunk = self.rfile.read(min(content_length, 65536))
+                if not chunk:
+                    break
+                content_length -= len(chunk)
 
         def log_message(self, format, *args):
             """Overloads the default message logging method to allow messages to
@@ -239,26 +345,6 @@ def WebhookRequestHandlerFactory(config, event_store, server_status, is_https=Fa
             logger = logging.getLogger()
             logger.info("%s - %s" % (self.client_address[0], format%args))
 
-        def save_test_case(self, test_case):
-            """Log request information in a way it can be used as a test case."""
-            import time
-            import json
-            import os
-
-            # Mask some header values
-            masked_headers = ['x-github-delivery', 'x-hub-signature']
-            for key in test_case['headers']:
-                if key in masked_headers:
-                    test_case['headers'][key] = 'xxx'
-
-            target = '%s-%s.tc.json' % (self.client_address[0], time.strftime("%Y%m%d%H%M%S"))
-            if 'log-test-case-dir' in self._config and self._config['log-test-case-dir']:
-                target = os.path.join(self._config['log-test-case-dir'], target)
-
-            file = open(target, 'w')
-            file.write(json.dumps(test_case, sort_keys=True, indent=4))
-            file.close()
-
         def get_server_status(self):
             """Generate a copy of the server status object that contains the public IP or hostname."""
 
@@ -311,11 +397,11 @@ def WebhookRequestHandlerFactory(config, event_store, server_status, is_https=Fa
             """Verify that the client address is whitelisted"""
 
             # Allow all if whitelist is empty
-            if len(self._config['web-ui-whitelist']) == 0:
+            if self._config['web-ui-allowlist'] is None:
                 return True
 
             # Verify that client IP is whitelisted
-            if self.client_address[0] in self._config['web-ui-whitelist']:
+            if self.client_address[0] in self._config['web-ui-allowlist']:
                 return True
 
             self.send_error(403, "%s is not allowed access" % self.client_address[0])
@@ -0,0 +1,159 @@
+def get_ssh_host(url):
+    """Returns the host and port (None for the default port) that a
+    repository URL is fetched from over ssh, or None if the URL does not use
+    ssh"""
+    import re
+    try:
+        from urlparse import urlsplit
+    except ImportError:
+        from urllib.parse import urlsplit
+
+    url = url.strip()
+
+    if re.match(r'^(ssh|git\+ssh|ssh\+git)://', url):
+        parts = urlsplit(url)
+        if not parts.hostname:
+            return None
+        return parts.hostname.lower(), parts.port
+
+    # Other URL schemes do not use ssh
+    if re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*://', url):
+        return None
+
+    # Scp-like syntax, e.g. git@github.com:olipo186/Git-Auto-Deploy.git
+    match = re.match(r'^(?:[^@/]+@)?([^:/]+):', url)
+    if match:
+        return match.group(1).lower(), None
+
+    return None
+
+
+def format_host(host, port):
+    """Returns the host as written in a known_hosts file"""
+    if port is None or port == 22:
+        return host
+    return '[%s]:%s' % (host, port)
+
+
+class KnownHostsFile(object):
+    """A known_hosts file, used as a cache of scanned host keys. Hosts that
+    are already present in the file are never scanned again."""
+
+    def __init__(self, path):
+        import os
+
+        self.path = os.path.expanduser(path)
+        self._names = set()
+        self._hashes = []
+        self.load()
+
+    def load(self):
+        import os
+
+        if not os.path.isfile(self.path):
+            return
+
+        with open(self.path) as input:
+            for line in input:
+                fields = line.split()
+
+                if len(fields) < 3 or fields[0].startswith('#'):
+                    continue
+
+                # Skip markers such as @cert-authority
+                names = fields[1] if fields[0].startswith('@') else fields[0]
+
+                for name in names.split(','):
+
+                    # Hashed host names, |1|salt|hash
+                    if name.startswith('|1|'):
+                        parts = name.split('|')
+                        if len(parts) == 4:
+                            self._hashes.append((parts[2], parts[3]))
+                        continue
+
+                    self._names.add(name.lower())
+
+    def contains(self, host, port=None):
+        import hmac
+        import base64
+        import hashlib
+
+        name = format_host(host, port)
+
+        if name in self._names:
+            return True
+
+        for salt, digest in self._hashes:
+            try:
+                key = base64.b64decode(salt)
+            except (TypeError, ValueError):
+                continue
+
+            if base64.b64encode(hmac.new(key, name.encode('utf-8'), hashlib.sha1).digest()).decode('utf-8') == digest:
+                return True
+
+        return False
+
+    def add(self, lines):
+        """Append host key lines, as printed by ssh-keyscan, to the file"""
+        import os
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+
+        with open(self.path, 'a') as output:
+            for line in lines:
+                output.write(line + '\n')
+
+        for line in lines:
+            for name in line.split()[0].split(','):
+                self._names.add(name.lower())
+
+
+def scan_host_keys(hosts, timeout=5):
+    """Scan the host keys of a list of (host, port) tuples. One ssh-keyscan
+    process is started per distinct port, scanning all of its hosts in
+    parallel. Returns the lines printed by ssh-keyscan."""
+    from subprocess import Popen, PIPE
+    import threading
+    import logging
+
+    logger = logging.getLogger()
+
+    ports = {}
+    for host, port in hosts:
+        ports.setdefault(port, []).append(host)
+
+    lines = []
+    lock = threading.Lock()
+
+    def scan(port, port_hosts):
+        command = ['ssh-keyscan', '-T', str(timeout)]
+        if port is not None:
+            command.extend(['-p', str(port)])
+        command.extend(port_hosts)
+
+        try:
+            p = Popen(command, stdout=PIPE, stderr=PIPE)
+            stdout, stderr = p.communicate()
+        except OSError as e:
+            logger.error("Unable to run ssh-keyscan: %s" % e)
+            return
+
+        with lock:
+            for line in stdout.decode('utf-8', 'replace').splitlines():
+                if line.strip() and not line.startswith('#'):
+                    lines.append(line.strip())
+
+    threads = []
+    for port, port_hosts in ports.items():
+        thread = threading.Thread(target=scan, args=(port, port_hosts))
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+    return lines
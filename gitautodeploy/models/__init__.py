@@ -1 +1,5 @@
-from .project import *
\ No newline at end of file
+from .project import *
+from .request import *
+from .index import *
+from .filter import *
+from .network import *
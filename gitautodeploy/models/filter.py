@@ -0,0 +1,202 @@
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+class FilterPattern(object):
+    """A precompiled filter value matching a pattern rather than a single
+    value. Specified in payload and header filters as an object holding one
+    of the operators glob, regex, prefix or in, e.g.
+    {"glob": "refs/heads/release/*"}."""
+
+    operators = ['glob', 'regex', 'prefix', 'in']
+
+    def __init__(self, operator, argument):
+        """Raises ValueError if the argument is not valid for the operator"""
+        import re
+        import fnmatch
+
+        self.operator = operator
+        self.argument = argument
+
+        if operator == 'in':
+            if not isinstance(argument, list):
+                raise ValueError("the argument of 'in' must be a list, got %r" % (argument,))
+            self._values = list(argument)
+            return
+
+        if not isinstance(argument, string_types):
+            raise ValueError("the argument of '%s' must be a string, got %r" % (operator, argument))
+
+        try:
+            if operator == 'glob':
+                self._regex = re.compile(fnmatch.translate(argument))
+            elif operator == 'regex':
+                self._regex = re.compile(argument)
+        except re.error as e:
+            raise ValueError("invalid regular expression %r: %s" % (argument, e))
+
+    def __repr__(self):
+        return "%s:%s" % (self.operator, self.argument)
+
+    def matches(self, value):
+
+        if self.operator == 'in':
+            return value in self._values
+
+        # All other operators only applies to strings
+        if not isinstance(value, string_types):
+            return False
+
+        if self.operator == 'prefix':
+            return value.startswith(self.argument)
+
+        if self.operator == 'glob':
+            return self._regex.match(value) is not None
+
+        return self._regex.search(value) is not None
+
+
+_patterns = {}
+
+
+def compile_filter_value(filter_value):
+    """Returns a FilterPattern if the filter value specifies a pattern
+    operator, otherwise the filter value itself. Patterns are compiled once
+    and shared by all filters using them. Raises ValueError if the pattern
+    is not valid."""
+    import json
+
+    if not isinstance(filter_value, dict) or len(filter_value) != 1:
+        return filter_value
+
+    operator, argument = list(filter_value.items())[0]
+    if operator not in FilterPattern.operators:
+        return filter_value
+
+    key = (operator, json.dumps(argument, sort_keys=True))
+    if key not in _patterns:
+        _patterns[key] = FilterPattern(operator, argument)
+
+    return _patterns[key]
+
+
+class PayloadFilterNode(object):
+    """A node in the payload filter trie. Holds the conditions that apply to
+    the payload value found at the path leading to this node."""
+
+    def __init__(self):
+        self.children = {}
+
+        # Projects requiring a specific value, keyed by that value
+        self.equals = {}
+
+        # Projects requiring an unhashable value, as (value, project id) tuples
+        self.others = []
+
+        # Projects accepting any value, as long as the path exists
+        self.wildcards = []
+
+        # Projects requiring a value matching a pattern, as (pattern, project id) tuples
+        self.patterns = []
+
+
+class PayloadFilterEngine(object):
+    """The payload filters of all projects, compiled into a single trie keyed
+    by path. Evaluating a payload reads each distinct path once, regardless
+    of how many projects filter on it, and yields all matching projects in
+    one pass."""
+
+    def __init__(self, projects=None):
+        self._root = PayloadFilterNode()
+
+        # Number of conditions that must be met, per project id
+        self._required = {}
+
+        for project in projects or []:
+            self.add(project)
+
+    def add(self, project):
+        conditions = project.get_payload_filter_conditions()
+        self._required[id(project)] = len(conditions)
+
+        for filter_key, path, filter_value in conditions:
+            node = self._root
+            for node_key in path:
+                node = node.children.setdefault(node_key, PayloadFilterNode())
+
+            if isinstance(filter_value, FilterPattern):
+                node.patterns.append((filter_value, id(project)))
+                continue
+
+            # If the filter value is set to True. the filter
+            # will pass regardless of the actual value
+            if filter_value == True:
+                node.wildcards.append(id(project))
+                continue
+
+            try:
+                node.equals.setdefault(filter_value, []).append(id(project))
+            except TypeError:
+                node.others.append((filter_value, id(project)))
+
+    def apply_filters(self, projects, payload, action):
+        """Returns the projects whose payload filters all match the payload"""
+
+        # Number of conditions met, per candidate project id
+        passed = dict((id(project), 0) for project in projects)
+
+        # Payload values resolved while walking the trie, keyed by path
+        values = {}
+
+        self.evaluate(self._root, payload, (), passed, values)
+
+        matching_projects = []
+        for project in projects:
+
+            if passed[id(project)] >= self._required.get(id(project), 0):
+                matching_projects.append(project)
+                continue
+
+            # Let the project log the reason why it did not match
+            project.passes_payload_filter(payload, action, values)
+
+        return matching_projects
+
+    def evaluate(self, node, value, path, passed, values):
+        """Visit all children of the node that are present in the payload"""
+
+        if not isinstance(value, dict):
+            return
+
+        for node_key, child in node.children.items():
+
+            # If the path is not valid the conditions below does not match
+            if node_key not in value:
+                continue
+
+            child_path = path + (node_key,)
+            child_value = value[node_key]
+            values[child_path] = child_value
+
+            hits = list(child.wildcards)
+
+            try:
+                hits.extend(child.equals.get(child_value, []))
+            except TypeError:
+                pass
+
+            for filter_value, project_id in child.others:
+                if filter_value == child_value:
+                    hits.append(project_id)
+
+            for pattern, project_id in child.patterns:
+                if project_id in passed and pattern.matches(child_value):
+                    hits.append(project_id)
+
+            for project_id in hits:
+                if project_id in passed:
+                    passed[project_id] += 1
+
+            self.evaluate(child, child_value, child_path, passed, values)
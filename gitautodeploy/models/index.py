@@ -0,0 +1,75 @@
+def split_url(url):
+    """Splits a repository URL into its host and path. Scp-like ssh URLs
+    (git@host:owner/repo), ssh://, git:// and http(s):// URLs are supported.
+    The host excludes any credentials and port, and is empty for bare
+    paths."""
+    import re
+    try:
+        from urlparse import urlsplit
+    except ImportError:
+        from urllib.parse import urlsplit
+
+    url = url.strip()
+
+    if re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*://', url):
+        parts = urlsplit(url)
+
+        # The hostname attribute excludes any credentials and port
+        return parts.hostname or '', parts.path
+
+    # Scp-like syntax, e.g. git@github.com:olipo186/Git-Auto-Deploy.git
+    match = re.match(r'^(?:[^@/]+@)?([^:/]+):(.*)$', url)
+
+    if match:
+        return match.group(1), match.group(2)
+
+    return '', url
+
+
+def normalize_url(url):
+    """Translates the different forms of a repository URL into a canonical key
+    that can be used for comparison. Scp-like ssh URLs (git@host:owner/repo),
+    ssh://, git:// and http(s):// URLs with or without credentials and port
+    all translate into host/owner/repo in lower case, without any .git
+    suffix. Bare paths, such as the Bitbucket full name or slug, keep their
+    path only."""
+
+    host, path = split_url(url)
+
+    path = path.strip('/')
+    if path.lower().endswith('.git'):
+        path = path[:-4]
+
+    if host:
+        return ('%s/%s' % (host, path)).lower()
+
+    return path.lower()
+
+
+class ProjectIndex(object):
+    """Maps canonical repository URLs to the projects they identify. Allows
+    the URLs referenced in an incoming webhook request to be matched without
+    scanning every configured repository."""
+
+    def __init__(self, projects=None):
+        self._projects = {}
+
+        for project in projects or []:
+            self.add(project)
+
+    def add(self, project):
+        keys = []
+        for url in project.get_match_urls():
+            key = normalize_url(url)
+            if key not in keys:
+                keys.append(key)
+
+        for key in keys:
+            self._projects.setdefault(key, []).append(project)
+
+    def get(self, url):
+        """Returns all projects matching the URL, in configured order"""
+        return self._projects.get(normalize_url(url), [])
+
+    def __len__(self):
+        return len(self._projects)
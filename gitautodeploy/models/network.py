@@ -0,0 +1,118 @@
+def parse_address(address):
+    """Returns the address family (4 or 6) and the integer value of an IP
+    address. IPv4 addresses mapped into IPv6 are treated as IPv4 addresses.
+    Raises ValueError if the address is invalid."""
+    import socket
+    import binascii
+
+    # Strip any IPv6 zone index, e.g. fe80::1%eth0
+    address = address.split('%')[0]
+
+    for family, version in [(socket.AF_INET, 4), (socket.AF_INET6, 6)]:
+        try:
+            packed = socket.inet_pton(family, address)
+        except (socket.error, ValueError):
+            continue
+
+        value = int(binascii.hexlify(packed), 16)
+
+        # ::ffff:a.b.c.d
+        if version == 6 and value >> 32 == 0xffff:
+            return 4, value & 0xffffffff
+
+        return version, value
+
+    raise ValueError("Invalid IP address '%s'" % address)
+
+
+def parse_network(network):
+    """Returns the address family, prefix length and network address of a
+    network in CIDR notation, e.g. 192.30.252.0/22. A single address is
+    treated as a network of its own. Raises ValueError if the network is
+    invalid."""
+
+    address, _, prefix = network.strip().partition('/')
+    version, value = parse_address(address)
+    bits = 32 if version == 4 else 128
+
+    # Prefix length of an IPv4 address mapped into IPv6
+    if prefix and version == 4 and ':' in address:
+        prefix = str(int(prefix) - 96)
+
+    prefix = int(prefix) if prefix else bits
+    if prefix < 0 or prefix > bits:
+        raise ValueError("Invalid network '%s'" % network)
+
+    mask = ((1 << prefix) - 1) << (bits - prefix)
+    return version, prefix, value & mask
+
+
+class AddressAllowlist(object):
+    """A set of networks in CIDR notation, indexed by prefix length. Looking
+    up an address takes one set lookup per distinct prefix length, regardless
+    of the number of networks."""
+
+    def __init__(self, networks=None):
+
+        # Network addresses, keyed by address family and prefix length
+        self._networks = {4: {}, 6: {}}
+
+        self.extend(networks or [])
+
+    def add(self, network):
+        version, prefix, value = parse_network(network)
+        self._networks[version].setdefault(prefix, set()).add(value)
+
+    def extend(self, networks):
+        """Add a list of networks. Entries that are not IP addresses or
+        networks, e.g. host names, can never match a client address and are
+        skipped with a warning."""
+        import logging
+        logger = logging.getLogger()
+
+        for network in networks:
+            try:
+                self.add(network)
+            except ValueError:
+                logger.warning("Ignoring whitelist entry '%s', which is not an IP address or network in CIDR notation" % network)
+
+    def load(self, path):
+        """Add networks from a file. The file can either be a JSON document
+        like the one published by GitHub at https://api.github.com/meta, in
+        which case the networks listed under "hooks" are added, or a plain
+        text file with one network per line."""
+        import json
+
+        with open(path) as input:
+            data = input.read()
+
+        try:
+            document = json.loads(data)
+        except ValueError:
+            document = None
+
+        if isinstance(document, dict):
+            networks = document.get('hooks', [])
+        elif isinstance(document, list):
+            networks = document
+        else:
+            networks = [line.split('#')[0] for line in data.splitlines()]
+
+        self.extend([network for network in networks if network.strip()])
+
+    def __contains__(self, address):
+        try:
+            version, value = parse_address(address)
+        except ValueError:
+            return False
+
+        bits = 32 if version == 4 else 128
+
+        for prefix, values in self._networks[version].items():
+            if value >> (bits - prefix) << (bits - prefix) in values:
+                return True
+
+        return False
+
+    def __len__(self):
+        return sum(len(values) for networks in self._networks.values() for values in networks.values())
@@ -1,8 +1,19 @@
 import collections
 from ..wrappers import GitWrapper
-from ..lock import Lock
-from ..wrappers import GitWrapper
 from ..events import DeployEvent
+from .filter import FilterPattern, compile_filter_value
+from .index import split_url
+
+
+def resolve_path(payload, path):
+    """Follow a path of keys into the payload. Returns a tuple holding a flag
+    indicating whether the path is valid, and the value found."""
+    node_value = payload
+    for node_key in path:
+        if not isinstance(node_value, dict) or node_key not in node_value:
+            return False, None
+        node_value = node_value[node_key]
+    return True, node_value
 
 
 class Project(collections.MutableMapping):
@@ -12,6 +23,16 @@ class Project(collections.MutableMapping):
 
     def __init__(self, *args, **kwargs):
         self.store = dict()
+        self._payload_filter_conditions = None
+        self._header_filter_conditions = None
+
+        # Whether the local copy of the repository is ready to be deployed:
+        # pending, preparing, ready, failed or not-cloned
+        self.state = 'ready'
+
+        # The commit of the last deploy that completed without errors
+        self.deployed_sha = None
+
         self.update(dict(*args, **kwargs))  # use the free update to set keys
 
     def __getitem__(self, key):
@@ -35,106 +56,200 @@ class Project(collections.MutableMapping):
     def get_name(self):
         return self['url'].split('/')[-1].split('.git')[0]
 
-    def passes_payload_filter(self, payload, action):
+    def get_remote_host(self):
+        """Returns the host name of the remote repository, or None if the URL
+        does not contain any"""
+        if not self.get('url'):
+            return None
+
+        return split_url(self['url'])[0].lower() or None
+
+    def get_deploy_key(self):
+        """Returns a key identifying the local working copy. Deploys with the
+        same key must not run concurrently."""
+        return self.get('path') or id(self)
 
-        # At least one filter must match
-        for filter in self['payload-filter']:
+    def get_match_urls(self):
+        """Returns the URLs that identifies this project in incoming webhook requests"""
+        urls = []
 
-            # All options specified in the filter must match
+        if self.get('match-url', self.get('url')) is not None:
+            urls.append(self.get('match-url', self.get('url')))
+
+        if 'url_without_usernme' in self and self['url_without_usernme'] not in urls:
+            urls.append(self['url_without_usernme'])
+
+        return urls
+
+    def get_payload_filter_conditions(self):
+        """Returns all conditions of the payload filters as a list of (filter
+        key, path, value) tuples, where path is a tuple of keys. Compiled once
+        and cached. Raises ValueError if a filter value is not valid."""
+
+        if self._payload_filter_conditions is not None:
+            return self._payload_filter_conditions
+
+        conditions = []
+        for filter in self.get('payload-filter', []):
             for filter_key, filter_value in filter.items():
 
                 # Ignore filters with value None (let them pass)
-                if filter_value == None:
+                if filter_value is None:
                     continue
 
-                # Interpret dots in filter name as path notations 
-                node_value = payload
-                for node_key in filter_key.split('.'):
+                try:
+                    filter_value = compile_filter_value(filter_value)
+                except ValueError as e:
+                    raise ValueError("Invalid payload-filter '%s': %s" % (filter_key, e))
 
-                    # If the path is not valid the filter does not match
-                    if not node_key in node_value:
-                        action.log_info("Filter '%s' does not match since the path is invalid" % (filter_key))
+                # Interpret dots in filter name as path notations
+                conditions.append((filter_key, tuple(filter_key.split('.')), filter_value))
 
-                        # Filter does not match, do not process this repo config
-                        return False
+        self._payload_filter_conditions = conditions
+        return conditions
 
-                    node_value = node_value[node_key]
+    def passes_payload_filter(self, payload, action, values=None):
+        """Verify that all payload filter conditions are met. Any values
+        already resolved from the payload can be provided as a dict keyed by
+        path."""
 
-                if filter_value == node_value:
-                    continue
+        # All options specified in all filters must match
+        for filter_key, path, filter_value in self.get_payload_filter_conditions():
+
+            if values is not None and path in values:
+                node_value = values[path]
+            else:
+                found, node_value = resolve_path(payload, path)
 
-                # If the filter value is set to True. the filter
-                # will pass regardless of the actual value
-                if filter_value == True:
+                # If the path is not valid the filter does not match
+                if not found:
+                    action.log_info("Filter '%s' does not match since the path is invalid" % (filter_key))
+
+                    # Filter does not match, do not process this repo config
+                    return False
+
+            if isinstance(filter_value, FilterPattern):
+                if filter_value.matches(node_value):
                     continue
 
-                action.log_debug("Filter '%s' does not match ('%s' != '%s')" % (filter_key, filter_value, (str(node_value)[:75] + '..') if len(str(node_value)) > 75 else str(node_value)))
+            elif filter_value == node_value:
+                continue
 
-                # Filter does not match, do not process this repo config
-                return False
+            # If the filter value is set to True. the filter
+            # will pass regardless of the actual value
+            if filter_value == True:
+                continue
+
+            action.log_debug("Filter '%s' does not match ('%s' != '%s')" % (filter_key, filter_value, (str(node_value)[:75] + '..') if len(str(node_value)) > 75 else str(node_value)))
+
+            # Filter does not match, do not process this repo config
+            return False
 
         # Filter does match, proceed
         return True
 
+    def get_header_filter_conditions(self):
+        """Returns the header filter as a list of (lower case header name,
+        value) tuples. Compiled once and cached. Raises ValueError if a filter
+        value is not valid."""
+
+        if self._header_filter_conditions is not None:
+            return self._header_filter_conditions
+
+        conditions = []
+        for key, value in self.get('header-filter', {}).items():
+            try:
+                conditions.append((key.lower(), compile_filter_value(value)))
+            except ValueError as e:
+                raise ValueError("Invalid header-filter '%s': %s" % (key, e))
+
+        self._header_filter_conditions = conditions
+        return conditions
+
     def passes_header_filter(self, request_headers):
 
-        # At least one filter must match
-        for key in self['header-filter']:
+        # All filters must match
+        for key, value in self.get_header_filter_conditions():
 
             # Verify that the request has the required header attribute
-            if key.lower() not in request_headers:
+            if key not in request_headers:
                 return False
 
             # "True" indicates that any header value is accepted
-            if self['header-filter'][key] is True:
+            if value is True:
+                continue
+
+            # Verify that the request header matches the pattern
+            if isinstance(value, FilterPattern):
+                if not value.matches(request_headers[key]):
+                    return False
                 continue
 
             # Verify that the request has the required header value
-            if self['header-filter'][key] != request_headers[key.lower()]:
+            if value != request_headers[key]:
                 return False
 
         # Filter does match, proceed
         return True
 
-    def apply_filters(self, request_headers, request_body, action):
-        """Verify that the suggested repositories has matching settings and
-        issue git pull and/or deploy commands."""
-        import os
-        import time
-        import json
+    def accepts_event(self, event_type):
+        """Verify that the event type is allowed by the project, if an
+        allowlist of event types is specified"""
 
-        payload = json.loads(request_body)
+        if 'events' not in self or event_type is None:
+            return True
 
-        # Verify that all payload filters matches the request (if any payload filters are specified)
-        if 'payload-filter' in self and not self.passes_payload_filter(payload, action):
+        return event_type in self['events']
 
-            # Filter does not match, do not process this repo config
-            return False
+    def prepare(self, cancellation=None):
+        """Clone the repository to its configured path, or initialize the
+        remote URL and checked out branch of an existing clone."""
+        import os
 
-        # Verify that all header filters matches the request (if any header filters are specified)
-        if 'header-filter' in self and not self.passes_header_filter(request_headers):
+        self.state = 'preparing'
 
-            # Filter does not match, do not process this repo config
-            return False
+        if os.path.isdir(self['path']) and os.path.isdir(os.path.join(self['path'], '.git')):
+            res = GitWrapper.init(self)
+        else:
+            res = GitWrapper.clone(self)
 
-        return True
+        self.state = 'ready' if res == 0 else 'failed'
 
-    def execute_webhook(self, event_store):
+    def get_status(self):
+        return {
+            'name': self.get_name(),
+            'url': self.get('url'),
+            'path': self.get('path'),
+            'state': self.state
+        }
+
+    def execute_webhook(self, event_store, commit_sha=None, cancellation=None):
         """Verify that the suggested repositories has matching settings and
-        issue git pull and/or deploy commands."""
+        issue git pull and/or deploy commands. Nothing is done if the commit
+        to deploy is already checked out. A cancelled deploy stops after the
+        current git command, or kills the current deploy command, and is
+        recorded as superseded. A deploy running out of time is stopped and
+        recorded as timed out."""
         import os
-        import time
         import json
+        import time
 
         event = DeployEvent(self)
         event_store.register_action(event)
         event.set_waiting(True)
         event.log_info("Running deploy commands")
 
+        # Time by which the pull and all deploy commands must have completed
+        deadline = None
+        if self.get('deploy-timeout'):
+            deadline = time.time() + self['deploy-timeout']
+
         # In case there is no path configured for the repository, no pull will
         # be made.
         if 'path' not in self:
-            res = GitWrapper.deploy(self)
+            res = GitWrapper.deploy(self, cancellation=cancellation, event=event, deadline=deadline)
+            if self.was_superseded(event, cancellation) or self.has_timed_out(event):
+                return
             event.log_info("%s" % res)
             event.set_waiting(False)
             event.set_success(True)
@@ -156,55 +271,65 @@ class Project(collections.MutableMapping):
             event.set_success(False)
             return
 
-        running_lock = Lock(os.path.join(self['path'], 'status_running'))
-        waiting_lock = Lock(os.path.join(self['path'], 'status_waiting'))
-        try:
+        # Skip the deploy if the commit has already been deployed successfully
+        # and is still checked out, e.g. after duplicate webhooks or pushes of
+        # tags. A failed deploy of the commit is run again.
+        if commit_sha is not None and self.get('skip-unchanged', True) and self.deployed_sha == commit_sha \
+                and GitWrapper.get_head(self['path']) == commit_sha:
+            event.log_info("Commit %s has already been deployed to %s, skipping deploy" % (commit_sha[:7], self['path']))
+            event.set_waiting(False)
+            event.set_success(True)
+            return
 
-            # Attempt to obtain the status_running lock
-            while not running_lock.obtain():
+        # Deploys of the same project are serialized by the deploy scheduler,
+        # so no other deploy is operating on the working copy at this point
+        n = 4
+        res = None
+        while n > 0:
 
-                # If we're unable, try once to obtain the status_waiting lock
-                if not waiting_lock.has_lock() and not waiting_lock.obtain():
-                    event.log_error("Unable to obtain the status_running lock nor the status_waiting lock. Another process is already waiting, so we'll ignore the request.")
+            # Attempt to pull up a maximum of 4 times
+            res = GitWrapper.pull(self, cancellation=cancellation, commit_sha=commit_sha, deadline=deadline, event=event)
 
-                    # If we're unable to obtain the waiting lock, ignore the request
-                    break
+            if self.was_superseded(event, cancellation) or self.has_timed_out(event):
+                return
 
-                # Keep on attempting to obtain the status_running lock until we succeed
-                time.sleep(5)
+            # Return code indicating success?
+            if res == 0:
+                break
 
-            n = 4
-            res = None
-            while n > 0:
+            n -= 1
 
-                # Attempt to pull up a maximum of 4 times
-                res = GitWrapper.pull(self)
+        if 0 < n:
+            res = GitWrapper.deploy(self, cancellation=cancellation, event=event, deadline=deadline)
 
-                # Return code indicating success?
-                if res == 0:
-                    break
+            if self.was_superseded(event, cancellation) or self.has_timed_out(event):
+                return
 
-                n -= 1
+            # Only a commit deployed without errors is skipped next time
+            self.deployed_sha = commit_sha if not any(res) else None
 
-            if 0 < n:
-                res = GitWrapper.deploy(self)
+        event.log_info("Deploy commands were executed")
+        event.set_waiting(False)
+        event.set_success(True)
+
+    def was_superseded(self, event, cancellation):
+        """Record the deploy as superseded if it has been cancelled"""
 
-        #except Exception as e:
-        #    logger.error('Error during \'pull\' or \'deploy\' operation on path: %s' % self['path'])
-        #    logger.error(e)
-        #    raise e
+        if cancellation is None or not cancellation.is_cancelled():
+            return False
 
-        finally:
+        event.log_warning("Deploy was cancelled since it was superseded by a newer request")
+        event.set_superseded(True)
+        event.set_waiting(False)
+        event.set_success(False)
+        return True
 
-            # Release the lock if it's ours
-            if running_lock.has_lock():
-                running_lock.release()
+    def has_timed_out(self, event):
+        """Complete the deploy as failed if it has been recorded as timed out"""
 
-            # Release the lock if it's ours
-            if waiting_lock.has_lock():
-                waiting_lock.release()
+        if not event.timed_out:
+            return False
 
-        event.log_info("Deploy commands were executed")
         event.set_waiting(False)
-        event.set_success(True)
-
+        event.set_success(False)
+        return True
@@ -0,0 +1,58 @@
+class WebhookRequest(object):
+    """An incoming webhook request. Holds the raw request body along with
+    normalized (lower case) header names, and decodes and parses the body at
+    most once regardless of how many parsers and projects inspect it."""
+
+    def __init__(self, client_address, headers, body):
+        self.client_address = client_address
+        self.headers = dict((k.lower(), v) for k, v in headers.items())
+        self.body = body
+        self._text = None
+        self._payload = None
+
+        # Key identifying this delivery, when deduplication is enabled
+        self.delivery_id = None
+
+    @property
+    def text(self):
+        """The request body decoded as a string"""
+        if self._text is None:
+            self._text = self.body.decode('utf-8') if isinstance(self.body, bytes) else self.body
+        return self._text
+
+    def get_delivery_id(self):
+        """Returns the unique delivery id set by GitHub, GitLab or Bitbucket.
+        For requests without any delivery id, a hash of the request body is
+        returned instead."""
+        import hashlib
+
+        for header in ['x-github-delivery', 'x-gitlab-event-uuid', 'x-request-uuid']:
+            if header in self.headers:
+                return '%s:%s' % (header, self.headers[header])
+
+        body = self.body if isinstance(self.body, bytes) else self.body.encode('utf-8')
+        return 'sha1:%s' % hashlib.sha1(body).hexdigest()
+
+    @property
+    def payload(self):
+        """The JSON payload of the request. Raises ValueError if the request
+        body is not a valid JSON document."""
+        import json
+        try:
+            from urlparse import parse_qs
+        except ImportError:
+            from urllib.parse import parse_qs
+
+        if self._payload is not None:
+            return self._payload
+
+        text = self.text
+
+        # Payloads from GitHub can be delivered as form data. Test the request for this pattern and extract json payload
+        if self.headers.get('content-type') == 'application/x-www-form-urlencoded':
+            res = parse_qs(text)
+            if 'payload' in res and len(res['payload']) == 1:
+                text = res['payload'][0]
+
+        self._payload = json.loads(text)
+        return self._payload
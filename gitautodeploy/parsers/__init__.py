@@ -6,25 +6,34 @@ from .generic import GenericRequestParser
 from .coding import CodingRequestParser
 
 
-def get_service_handler(request_headers, request_body, action):
+def get_event_type(request_headers):
+    """Returns the type of event, e.g. push, as specified by the event header
+    set by GitHub, GitLab, Coding or Bitbucket. Returns None for requests
+    without any known event header."""
+
+    for header in ['x-github-event', 'x-gitlab-event', 'x-coding-event', 'x-event-key']:
+        if header in request_headers:
+            return request_headers[header]
+
+
+def get_service_handler(request, action):
     """Parses the incoming request and attempts to determine whether
     it originates from GitHub, GitLab or any other known service."""
-    import json
 
-    payload = json.loads(request_body)
+    payload = request.payload
 
     if not isinstance(payload, dict):
         raise ValueError("Invalid JSON object")
 
-    user_agent = 'user-agent' in request_headers and request_headers['user-agent']
-    content_type = 'content-type' in request_headers and request_headers['content-type']
+    user_agent = 'user-agent' in request.headers and request.headers['user-agent']
+    content_type = 'content-type' in request.headers and request.headers['content-type']
 
     # Assume Coding if the X-Coding-Event HTTP header is set
-    if 'x-coding-event' in request_headers:
+    if 'x-coding-event' in request.headers:
         return CodingRequestParser
 
     # Assume GitLab if the X-Gitlab-Event HTTP header is set
-    elif 'x-gitlab-event' in request_headers:
+    elif 'x-gitlab-event' in request.headers:
 
         # Special Case for Gitlab CI
         if content_type == "application/json" and "build_status" in payload:
@@ -33,7 +42,7 @@ def get_service_handler(request_headers, request_body, action):
             return GitLabRequestParser
 
     # Assume GitHub if the X-GitHub-Event HTTP header is set
-    elif 'x-github-event' in request_headers:
+    elif 'x-github-event' in request.headers:
 
         return GitHubRequestParser
 
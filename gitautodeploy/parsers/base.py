@@ -7,23 +7,44 @@ class WebhookRequestParserBase(object):
 
     def get_matching_repo_configs(self, urls, action):
         """Iterates over the various repo URLs provided as argument (git://,
-        ssh:// and https:// for the repo) and compare them to any repo URL
-        specified in the config"""
+        ssh:// and https:// for the repo) and looks them up in the index of
+        repo URLs specified in the config"""
 
-        configs = []
+        from ..models import normalize_url
+
+        # Several of the URLs are typically different forms of the same
+        # canonical URL, which only needs to be looked up once
+        keys = []
         for url in urls:
-            for repo_config in self._config['repositories']:
-                if repo_config in configs:
+            key = normalize_url(url)
+            if key not in keys:
+                keys.append(key)
+
+        configs = []
+        matched = set()
+        for key in keys:
+            for repo_config in self._config['project-index'].get(key):
+                if id(repo_config) in matched:
                     continue
-                if repo_config.get('match-url', repo_config.get('url')) == url:
-                    configs.append(repo_config)
-                elif 'url_without_usernme' in repo_config and repo_config['url_without_usernme'] == url:
-                    configs.append(repo_config)
+                matched.add(id(repo_config))
+                configs.append(repo_config)
 
         if len(configs) == 0:
             action.log_warning('The URLs references in the webhook did not match any repository entry in the config. For this webhook to work, make sure you have at least one repository configured with one of the following URLs; %s' % ', '.join(urls))
 
         return configs
 
-    def validate_request(self, request_headers, request_body, repo_configs, action):
+    def validate_request(self, request, repo_configs, action):
         return True
+
+    def get_commit_sha(self, request):
+        """Returns the SHA of the commit that the request asks to deploy, or
+        None if it is not known"""
+        return None
+
+    def get_valid_sha(self, sha):
+        """Returns the SHA unless it is missing or all zeros, which is used
+        for deleted refs"""
+        if not sha or not sha.strip('0'):
+            return None
+        return sha.lower()
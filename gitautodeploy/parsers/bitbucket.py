@@ -3,10 +3,8 @@ from .base import WebhookRequestParserBase
 
 class BitBucketRequestParser(WebhookRequestParserBase):
 
-    def get_matching_projects(self, request_headers, request_body, action):
-        import json
-
-        data = json.loads(request_body)
+    def get_matching_projects(self, request, action):
+        data = request.payload
 
         repo_urls = []
 
@@ -42,3 +40,21 @@ class BitBucketRequestParser(WebhookRequestParserBase):
         repo_configs = self.get_matching_repo_configs(repo_urls, action)
 
         return repo_configs
+
+    def get_commit_sha(self, request):
+        data = request.payload
+
+        try:
+            # Bitbucket Cloud push events
+            if 'push' in data:
+                return self.get_valid_sha(data['push']['changes'][-1]['new']['target']['hash'])
+
+            # Bitbucket Server events
+            for key in ['changes', 'refChanges']:
+                if key in data:
+                    return self.get_valid_sha(data[key][-1]['toHash'])
+
+        except (KeyError, IndexError, TypeError):
+            pass
+
+        return None
@@ -3,14 +3,12 @@ from .base import WebhookRequestParserBase
 
 class CodingRequestParser(WebhookRequestParserBase):
 
-    def get_matching_projects(self, request_headers, request_body, action):
-        import json
-
-        data = json.loads(request_body)
+    def get_matching_projects(self, request, action):
+        data = request.payload
 
         repo_urls = []
 
-        coding_event = 'x-coding-event' in request_headers and request_headers['x-coding-event']
+        coding_event = 'x-coding-event' in request.headers and request.headers['x-coding-event']
 
         if 'repository' not in data:
             action.log_error("Unable to recognize data format")
@@ -36,5 +34,8 @@ class CodingRequestParser(WebhookRequestParserBase):
 
         return repo_configs
 
+    def get_commit_sha(self, request):
+        return self.get_valid_sha(request.payload.get('after'))
+
     def verify_token(self, secret_token, request_token):
         return secret_token == request_token
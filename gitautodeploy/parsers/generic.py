@@ -3,10 +3,8 @@ from .base import WebhookRequestParserBase
 
 class GenericRequestParser(WebhookRequestParserBase):
 
-    def get_matching_projects(self, request_headers, request_body, action):
-        import json
-
-        data = json.loads(request_body)
+    def get_matching_projects(self, request, action):
+        data = request.payload
 
         repo_urls = []
 
@@ -26,3 +24,6 @@ class GenericRequestParser(WebhookRequestParserBase):
 
         return repo_configs
 
+    def get_commit_sha(self, request):
+        data = request.payload
+        return self.get_valid_sha(data.get('checkout_sha') or data.get('after'))
@@ -3,14 +3,12 @@ from .base import WebhookRequestParserBase
 
 class GitHubRequestParser(WebhookRequestParserBase):
 
-    def get_matching_projects(self, request_headers, request_body, action):
-        import json
-
-        data = json.loads(request_body)
+    def get_matching_projects(self, request, action):
+        data = request.payload
 
         repo_urls = []
 
-        github_event = 'x-github-event' in request_headers and request_headers['x-github-event']
+        github_event = 'x-github-event' in request.headers and request.headers['x-github-event']
 
         action.log_info("Received '%s' event from GitHub" % github_event)
 
@@ -28,13 +26,16 @@ class GitHubRequestParser(WebhookRequestParserBase):
 
         return repo_configs
 
-    def validate_request(self, request_headers, request_body, repo_configs, action):
+    def get_commit_sha(self, request):
+        return self.get_valid_sha(request.payload.get('after'))
+
+    def validate_request(self, request, repo_configs, action):
 
         for repo_config in repo_configs:
 
             # Validate secret token if present
-            if 'secret-token' in repo_config and 'x-hub-signature' in request_headers:
-                if not self.verify_signature(repo_config['secret-token'], request_body, request_headers['x-hub-signature']):
+            if 'secret-token' in repo_config and 'x-hub-signature' in request.headers:
+                if not self.verify_signature(repo_config['secret-token'], request.body, request.headers['x-hub-signature']):
                     action.log_info("Request signature does not match the 'secret-token' configured for repository %s." % repo_config['url'])
                     return False
 
@@ -44,5 +45,11 @@ class GitHubRequestParser(WebhookRequestParserBase):
         import hashlib
         import hmac
 
-        result = "sha1=" + hmac.new(str(token), body, hashlib.sha1).hexdigest()
+        # HMAC requires bytes on Python 3
+        if not isinstance(token, bytes):
+            token = token.encode('utf-8')
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+
+        result = "sha1=" + hmac.new(token, body, hashlib.sha1).hexdigest()
         return result == signature
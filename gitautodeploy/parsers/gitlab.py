@@ -3,14 +3,12 @@ from .base import WebhookRequestParserBase
 
 class GitLabRequestParser(WebhookRequestParserBase):
 
-    def get_matching_projects(self, request_headers, request_body, action):
-        import json
-
-        data = json.loads(request_body)
+    def get_matching_projects(self, request, action):
+        data = request.payload
 
         repo_urls = []
 
-        gitlab_event = 'x-gitlab-event' in request_headers and request_headers['x-gitlab-event']
+        gitlab_event = 'x-gitlab-event' in request.headers and request.headers['x-gitlab-event']
 
         action.log_info("Received '%s' event from GitLab" % gitlab_event)
 
@@ -28,14 +26,18 @@ class GitLabRequestParser(WebhookRequestParserBase):
 
         return repo_configs
 
-    def validate_request(self, request_headers, request_body, repo_configs, action):
+    def get_commit_sha(self, request):
+        data = request.payload
+        return self.get_valid_sha(data.get('checkout_sha') or data.get('after'))
+
+    def validate_request(self, request, repo_configs, action):
 
         for repo_config in repo_configs:
 
             # Validate secret token if present
-            if 'secret-token' in repo_config and 'x-gitlab-token' in request_headers:
+            if 'secret-token' in repo_config and 'x-gitlab-token' in request.headers:
 
-                if repo_config['secret-token'] != request_headers['x-gitlab-token']:
+                if repo_config['secret-token'] != request.headers['x-gitlab-token']:
                     action.log_info("Request token does not match the 'secret-token' configured for repository %s." % repo_config['url'])
                     return False
 
@@ -3,10 +3,8 @@ from .base import WebhookRequestParserBase
 
 class GitLabCIRequestParser(WebhookRequestParserBase):
 
-    def get_matching_projects(self, request_headers, request_body, action):
-        import json
-
-        data = json.loads(request_body)
+    def get_matching_projects(self, request, action):
+        data = request.payload
 
         repo_urls = []
 
@@ -29,3 +27,6 @@ class GitLabCIRequestParser(WebhookRequestParserBase):
         repo_configs = self.get_matching_repo_configs(repo_urls, action)
 
         return repo_configs
+
+    def get_commit_sha(self, request):
+        return self.get_valid_sha(request.payload.get('sha'))
@@ -0,0 +1,60 @@
+class TokenBucket(object):
+    """Allows bursts of up to a fixed number of events, refilled at a fixed
+    rate (tokens per second)."""
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, now):
+        self.refill(now)
+
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        return True
+
+    def is_full(self, now):
+        self.refill(now)
+        return self.tokens >= self.burst
+
+
+class RateLimiter(object):
+    """Thread safe rate limiting using one token bucket per key, e.g. per
+    client IP address."""
+
+    def __init__(self, rate, burst, max_keys=10000):
+        import threading
+
+        self._rate = rate
+        self._burst = burst
+        self._max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        """Consume one token from the bucket of the key. Returns False if the
+        bucket is empty."""
+        import time
+
+        now = time.time()
+
+        with self._lock:
+
+            if key not in self._buckets:
+
+                # Forget about idle keys, whose buckets are full again
+                if len(self._buckets) >= self._max_keys:
+                    for idle_key in [k for k, bucket in self._buckets.items() if bucket.is_full(now)]:
+                        del self._buckets[idle_key]
+
+                self._buckets[key] = TokenBucket(self._rate, self._burst, now)
+
+            return self._buckets[key].consume(now)
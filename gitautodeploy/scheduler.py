@@ -0,0 +1,238 @@
+class Cancellation(object):
+    """Allows a running deploy to be aborted by another thread. Processes
+    attached to the cancellation are killed, along with their process group,
+    once it is cancelled. Other operations are expected to check whether the
+    deploy has been cancelled at points where it is safe to stop."""
+
+    def __init__(self):
+        import threading
+
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._process = None
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            if self._process is not None:
+                self.kill(self._process)
+
+    def is_cancelled(self):
+        return self._cancelled
+
+    def attach(self, process):
+        """Attach a running process, which will be killed if the deploy is
+        cancelled. Returns False if the deploy was already cancelled, in which
+        case the process is killed right away."""
+        with self._lock:
+            if self._cancelled:
+                self.kill(process)
+                return False
+
+            self._process = process
+            return True
+
+    def detach(self):
+        with self._lock:
+            self._process = None
+
+    @staticmethod
+    def kill(process):
+        """Kill the process, and on POSIX systems any processes it started in
+        its process group"""
+        import os
+        import signal
+
+        try:
+            if hasattr(os, 'killpg'):
+                os.killpg(os.getpgid(process.pid), signal.SIGKILL)
+            else:
+                process.kill()
+        except OSError:
+            pass
+
+
+class DeployJob(object):
+    """A deploy waiting to be executed by the scheduler"""
+
+    def __init__(self, key, host, target, args, supersede=False):
+        import time
+
+        self.key = key
+        self.host = host
+        self.target = target
+        self.args = args
+        self.supersede = supersede
+        self.cancellation = Cancellation()
+        self.submitted = time.time()
+
+
+class DeployScheduler(object):
+    """Executes deploys on a bounded number of worker threads. Deploys of the
+    same project never run concurrently, and the number of concurrent deploys
+    fetching from the same remote host can be limited. Waiting deploys are
+    started in the order they were submitted, as soon as their constraints
+    allow it.
+
+    A project has at most one waiting deploy. Deploys submitted while one is
+    already waiting are merged into it, so that any number of pushes arriving
+    during a deploy results in exactly one follow-up deploy, executed with
+    the arguments of the newest push.
+
+    Deploys of projects with the cancel-superseded option enabled are
+    cancelled when a newer deploy of the same project is submitted. Targets
+    are called with a cancellation keyword argument for this purpose. Tasks
+    submitted as not cancellable, such as cloning a repository, are never
+    cancelled.
+
+    Worker threads are started on demand by the dispatcher, and exit when no
+    more deploys can be started."""
+
+    def __init__(self, max_workers=0, max_per_host=0, dispatcher=None):
+        import threading
+        import collections
+
+        # A limit of 0 means unlimited
+        self._max_workers = max_workers
+        self._max_per_host = max_per_host
+        self._dispatcher = dispatcher or self.start_thread
+
+        self._lock = threading.Lock()
+        self._pending = collections.deque()
+        self._running = {}
+        self._running_hosts = {}
+        self._workers = 0
+
+        self._stats = {
+            'submitted': 0,
+            'started': 0,
+            'completed': 0,
+            'failed': 0,
+            'coalesced': 0,
+            'superseded': 0,
+            'max-queue-depth': 0,
+            'total-wait-time': 0.0,
+            'max-wait-time': 0.0
+        }
+
+    @staticmethod
+    def start_thread(target, *args):
+        """Default dispatcher that runs each worker in a thread of its own"""
+        import threading
+        thread = threading.Thread(target=target, args=args)
+        thread.start()
+
+    def set_dispatcher(self, dispatcher):
+        self._dispatcher = dispatcher
+
+    def submit(self, project, target, *args, **kwargs):
+        """Schedule the target to be called with the given arguments, subject
+        to the constraints of the project. Returns False if the deploy was
+        merged into one that is already waiting. Targets submitted with
+        cancellable=False are never superseded."""
+
+        # Deploys supersede each other, while tasks that are not cancellable
+        # neither supersede nor get superseded
+        supersede = project.get('cancel-superseded', False) and kwargs.get('cancellable', True)
+        job = DeployJob(project.get_deploy_key(), project.get_remote_host(), target, args, supersede)
+
+        with self._lock:
+
+            # Abort the running deploy of the project, if it is to be superseded
+            running_job = self._running.get(job.key)
+            if job.supersede and running_job is not None and running_job.supersede \
+                    and not running_job.cancellation.is_cancelled():
+                running_job.cancellation.cancel()
+                self._stats['superseded'] += 1
+
+            # Let the waiting deploy of the project use the newest arguments
+            for pending_job in self._pending:
+                if pending_job.key == job.key and pending_job.target == job.target:
+                    pending_job.target = job.target
+                    pending_job.args = job.args
+                    pending_job.supersede = job.supersede
+                    self._stats['submitted'] += 1
+                    self._stats['coalesced'] += 1
+                    return False
+
+            self._pending.append(job)
+            self._stats['submitted'] += 1
+            self._stats['max-queue-depth'] = max(self._stats['max-queue-depth'], len(self._pending))
+
+            if self._max_workers and self._workers >= self._max_workers:
+                return True
+
+            self._workers += 1
+
+        self._dispatcher(self.run_worker)
+        return True
+
+    def next_job(self):
+        """Remove and return the first waiting deploy that can be started
+        right away, or None. Must be called with the lock held."""
+
+        for job in self._pending:
+
+            # Deploys of the same project are serialized
+            if job.key in self._running:
+                continue
+
+            if self._max_per_host and job.host is not None and self._running_hosts.get(job.host, 0) >= self._max_per_host:
+                continue
+
+            self._pending.remove(job)
+            self._running[job.key] = job
+            if job.host is not None:
+                self._running_hosts[job.host] = self._running_hosts.get(job.host, 0) + 1
+
+            return job
+
+    def run_worker(self):
+        """Execute deploys until none of the waiting deploys can be started.
+        Any deploy held back by a running one is picked up by the worker
+        executing that one, once it has completed."""
+        import time
+        import logging
+        logger = logging.getLogger()
+
+        while True:
+
+            with self._lock:
+                job = self.next_job()
+
+                if job is None:
+                    self._workers -= 1
+                    return
+
+                wait_time = time.time() - job.submitted
+                self._stats['started'] += 1
+                self._stats['total-wait-time'] += wait_time
+                self._stats['max-wait-time'] = max(self._stats['max-wait-time'], wait_time)
+
+            success = False
+            try:
+                job.target(*job.args, cancellation=job.cancellation)
+                success = True
+
+            except Exception as e:
+                logger.exception(e)
+
+            finally:
+                with self._lock:
+                    del self._running[job.key]
+                    if job.host is not None:
+                        self._running_hosts[job.host] -= 1
+                        if self._running_hosts[job.host] == 0:
+                            del self._running_hosts[job.host]
+
+                    self._stats['completed' if success else 'failed'] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['queue-depth'] = len(self._pending)
+            stats['running'] = len(self._running)
+            stats['workers'] = self._workers
+
+        stats['average-wait-time'] = stats['total-wait-time'] / stats['started'] if stats['started'] else 0.0
+        return stats
@@ -0,0 +1,425 @@
+from __future__ import absolute_import
+from .events import WebhookAction
+from .parsers import get_service_handler, get_event_type
+
+
+class WebhookRequestProcessor(object):
+    """Processes incoming webhook requests independently of the server that
+    received them. Identifies the source service, finds the matching projects
+    and schedules their deploys."""
+
+    def __init__(self, config, event_store, dispatcher=None):
+        import threading
+        from .cache import ExpiringCache
+        from .ratelimit import RateLimiter
+        from .scheduler import DeployScheduler
+
+        self._config = config
+        self._event_store = event_store
+
+        # Deploys are executed on a bounded number of worker threads
+        self._scheduler = DeployScheduler(config['deploy-max-workers'], config['deploy-max-per-host'], dispatcher)
+
+        self._intake_queue = None
+        self._intake_workers = []
+        self._deliveries = None
+        self._stats = {
+            'duplicate-deliveries': 0,
+            'deploys-saved': 0,
+            'rate-limited-requests': 0,
+            'rate-limited-deploys': 0,
+            'rejected-sources': 0
+        }
+        self._stats_lock = threading.Lock()
+
+        # Limit the rate of requests per client IP address and of deploys per project
+        self._client_limiter = None
+        self._project_limiter = None
+
+        if config['webhook-client-rate'] > 0:
+            self._client_limiter = RateLimiter(config['webhook-client-rate'], config['webhook-client-burst'])
+
+        if config['webhook-project-rate'] > 0:
+            self._project_limiter = RateLimiter(config['webhook-project-rate'], config['webhook-project-burst'])
+
+        # Remember recent deliveries, so that redelivered requests are not deployed twice
+        if config['webhook-dedup']:
+            self._deliveries = ExpiringCache(config['webhook-dedup-size'], config['webhook-dedup-ttl'])
+
+        # Secret tokens used to authenticate requests before they are queued.
+        # None means that at least one repository accepts requests without a
+        # token, in which case no request can be rejected up front.
+        self._secret_tokens = set()
+        for repo_config in config['repositories']:
+            if 'secret-token' not in repo_config:
+                self._secret_tokens = None
+                break
+            self._secret_tokens.add(repo_config['secret-token'])
+
+        # Event types accepted by at least one repository. None means that at
+        # least one repository accepts events of any type.
+        self._accepted_events = set()
+        for repo_config in config['repositories']:
+            if 'events' not in repo_config:
+                self._accepted_events = None
+                break
+            self._accepted_events.update(repo_config['events'])
+
+        if config['webhook-async-ack']:
+            self.start()
+
+    def set_dispatcher(self, dispatcher):
+        """Set the function used to start deploy worker threads"""
+        self._scheduler.set_dispatcher(dispatcher)
+
+    def start(self):
+        """Start the worker threads that process queued requests"""
+        import threading
+        try:
+            from Queue import Queue
+        except ImportError:
+            from queue import Queue
+
+        self._intake_queue = Queue(self._config['webhook-intake-queue-size'])
+
+        for index in range(self._config['webhook-intake-workers']):
+            worker = threading.Thread(target=self.process_queue, name="webhook-intake-%s" % index)
+            worker.daemon = True
+            worker.start()
+            self._intake_workers.append(worker)
+
+    def stop(self):
+        """Stop all worker threads once the currently queued requests are processed"""
+        for worker in self._intake_workers:
+            self._intake_queue.put(None)
+        self._intake_workers = []
+
+    def process_queue(self):
+        """Process queued requests until a stop signal (None) is received"""
+        import logging
+        logger = logging.getLogger()
+
+        while True:
+            request = self._intake_queue.get()
+
+            if request is None:
+                return
+
+            try:
+                status, message = self.process(request)
+            except Exception as e:
+                logger.error("Unable to process queued request: %s" % e)
+                continue
+
+            if status >= 300:
+                self.forget_delivery(request)
+
+    def is_allowed_source(self, client_address):
+        """Verify that the client address is whitelisted to send webhook
+        requests. Meant to be checked before anything else is done."""
+        import logging
+
+        # Allow all if whitelist is empty
+        if self._config['webhook-allowlist'] is None:
+            return True
+
+        if client_address[0] in self._config['webhook-allowlist']:
+            return True
+
+        self.count('rejected-sources')
+        logging.getLogger().info("Rejecting request from %s (not whitelisted)" % client_address[0])
+        return False
+
+    def screen(self, client_address, request_headers):
+        """Decides, based on the request headers alone, whether the request
+        can be ignored without reading and parsing its body. Returns a tuple
+        holding the HTTP status code and message for requests that should be
+        ignored, otherwise None."""
+        import logging
+        logger = logging.getLogger()
+
+        event_type = get_event_type(dict((k.lower(), v) for k, v in request_headers.items()))
+
+        if event_type is not None and self._config['webhook-events'] and event_type not in self._config['webhook-events']:
+            logger.info("Ignoring '%s' event from %s (not in webhook-events)" % (event_type, client_address[0]))
+            return 202, 'Accepted'
+
+        if event_type is not None and self._accepted_events is not None and event_type not in self._accepted_events:
+            logger.info("Ignoring '%s' event from %s (not accepted by any repository)" % (event_type, client_address[0]))
+            return 202, 'Accepted'
+
+        if self._client_limiter is not None and not self._client_limiter.allow(client_address[0]):
+            self.count('rate-limited-requests')
+            logger.warning("Rejecting request from %s (rate limit exceeded)" % client_address[0])
+            return 429, 'Too many requests'
+
+    def schedule(self, project, target, *args):
+        """Schedule a task operating on the local copy of the project, such
+        as cloning it. Tasks are serialized with the deploys of the project,
+        and are never cancelled by newer deploys."""
+        return self._scheduler.submit(project, target, *args, cancellable=False)
+
+    def get_repository_status(self):
+        return [project.get_status() for project in self._config['repositories']]
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+
+        stats['deploy-queue'] = self._scheduler.get_stats()
+        return stats
+
+    def count(self, key, value=1):
+        with self._stats_lock:
+            self._stats[key] += value
+
+    def handle(self, request):
+        """Entry point used by the servers. Either processes the request right
+        away, or queues it and acknowledges it with 202 Accepted if
+        webhook-async-ack is enabled."""
+        import logging
+        logger = logging.getLogger()
+
+        if self._deliveries is not None:
+            request.delivery_id = request.get_delivery_id()
+
+            # The value holds the number of deploys triggered by the delivery
+            if not self._deliveries.add(request.delivery_id, 0):
+                self.count('duplicate-deliveries')
+                self.count('deploys-saved', self._deliveries.get(request.delivery_id, 0))
+
+                logger.info("Ignoring duplicate delivery %s from %s" % (request.delivery_id, request.client_address[0]))
+                return 202, 'Accepted'
+
+        if self._intake_queue is not None:
+            status, message = self.accept(request)
+        else:
+            status, message = self.process(request)
+
+        # Only deliveries that were accepted are kept, so that a delivery
+        # that was rejected, e.g. due to a secret token mismatch, can be
+        # redelivered once the problem has been fixed
+        if status >= 300:
+            self.forget_delivery(request)
+
+        return status, message
+
+    def forget_delivery(self, request):
+        """Allow a delivery that could not be processed to be retried"""
+        if self._deliveries is not None and request.delivery_id is not None:
+            self._deliveries.remove(request.delivery_id)
+
+    def accept(self, request):
+        """Authenticates the request and queues it for processing by one of
+        the worker threads. The outcome is recorded by the WebhookAction
+        that is created once the request is processed."""
+        import logging
+        try:
+            from Queue import Full
+        except ImportError:
+            from queue import Full
+
+        logger = logging.getLogger()
+
+        if not self.authenticate(request):
+            logger.warning("Request from %s was rejected due to a secret token mismatch" % request.client_address[0])
+            return 400, 'Bad request'
+
+        try:
+            self._intake_queue.put_nowait(request)
+        except Full:
+            logger.warning("Intake queue is full, rejecting request from %s" % request.client_address[0])
+            return 503, 'Service unavailable'
+
+        return 202, 'Accepted'
+
+    def authenticate(self, request):
+        """Verifies any GitLab token or GitHub signature in the request against
+        the configured secret tokens, without parsing the request body. The
+        secret token of each matching project is verified again when the
+        request is processed."""
+        from .parsers import GitHubRequestParser
+
+        if self._secret_tokens is None:
+            return True
+
+        if 'x-gitlab-token' in request.headers:
+            return request.headers['x-gitlab-token'] in self._secret_tokens
+
+        if 'x-hub-signature' in request.headers:
+            parser = GitHubRequestParser(self._config)
+            for token in self._secret_tokens:
+                if parser.verify_signature(token, request.body, request.headers['x-hub-signature']):
+                    return True
+            return False
+
+        return True
+
+    def process(self, request):
+        """Handles a webhook request and returns a tuple holding the HTTP status
+        code and message that should be sent back to the client."""
+        client_address = request.client_address
+
+        action = WebhookAction(client_address, request.headers, request.text)
+        self._event_store.register_action(action)
+        action.set_waiting(True)
+
+        action.log_info('Incoming request from %s:%s' % (client_address[0], client_address[1]))
+
+        # Test case debug data
+        test_case = {
+            'headers': dict(request.headers),
+            'payload': request.payload,
+            'config': {},
+            'expected': {'status': 200, 'data': [{'deploy': 0}]}
+        }
+
+        try:
+
+            # Will raise a ValueError exception if it fails
+            ServiceRequestHandler = get_service_handler(request, action)
+
+            # Unable to identify the source of the request
+            if not ServiceRequestHandler:
+                test_case['expected']['status'] = 400
+                action.log_error("Unable to find appropriate handler for request. The source service is not supported")
+                action.set_waiting(False)
+                action.set_success(False)
+                return 400, 'Unrecognized service'
+
+            service_handler = ServiceRequestHandler(self._config)
+
+            action.log_info("Handling the request with %s" % ServiceRequestHandler.__name__)
+
+            # Could be GitHubParser, GitLabParser or other
+            projects = service_handler.get_matching_projects(request, action)
+
+            action.log_info("%s candidates matches the request" % len(projects))
+
+            # The commit to deploy, if known
+            commit_sha = service_handler.get_commit_sha(request)
+
+            if len(projects) == 0:
+                test_case['expected']['status'] = 400
+                action.log_error("No matching projects")
+                action.set_waiting(False)
+                action.set_success(False)
+                return 400, 'Bad request'
+
+            # Apply payload filters of all candidates in one pass
+            projects = self._config['payload-filter-engine'].apply_filters(projects, request.payload, action)
+
+            # Apply header filters and event type allowlists
+            event_type = get_event_type(request.headers)
+            matching_projects = []
+            for project in projects:
+                if project.passes_header_filter(request.headers) and project.accepts_event(event_type):
+                    matching_projects.append(project)
+
+            # Only keep projects that matches
+            projects = matching_projects
+
+            action.log_info("%s candidates matches after applying filters" % len(projects))
+
+            if not service_handler.validate_request(request, projects, action):
+                test_case['expected']['status'] = 400
+                action.log_warning("Request was rejected due to a secret token mismatch")
+                action.set_waiting(False)
+                action.set_success(False)
+                return 400, 'Bad request'
+
+            # Drop projects that are deployed too frequently
+            if self._project_limiter is not None:
+                allowed_projects = []
+                for project in projects:
+                    if self._project_limiter.allow(id(project)):
+                        allowed_projects.append(project)
+                        continue
+
+                    self.count('rate-limited-deploys')
+                    action.log_warning("Skipping deploy of %s (rate limit exceeded)" % project.get_name())
+
+                if len(projects) > 0 and len(allowed_projects) == 0:
+                    test_case['expected']['status'] = 429
+                    action.set_waiting(False)
+                    action.set_success(False)
+                    return 429, 'Too many requests'
+
+                projects = allowed_projects
+
+            test_case['expected']['status'] = 200
+
+            if len(projects) == 0:
+                action.set_waiting(False)
+                action.set_success(False)
+                return 200, 'OK'
+
+            action.log_info("Proceeding with %s candidates" % len(projects))
+            action.set_waiting(False)
+            action.set_success(True)
+
+            if self._deliveries is not None and request.delivery_id is not None:
+                self._deliveries.set(request.delivery_id, len(projects))
+
+            for project in projects:
+
+                # Repositories that are cloned on demand are cloned before their first deploy
+                if project.state == 'not-cloned':
+                    project.state = 'pending'
+                    action.log_info("Cloning %s before it is deployed" % project.get_name())
+                    self.schedule(project, project.prepare)
+
+                # Schedule the execution of the webhook (git pull and trigger deploy etc)
+                if not self._scheduler.submit(project, project.execute_webhook, self._event_store, commit_sha):
+                    action.log_info("A deploy of %s is already waiting and will include this request" % project.get_name())
+
+                # Add additional test case data
+                test_case['config'] = {
+                    'url': 'url' in project and project['url'],
+                    'branch': 'branch' in project and project['branch'],
+                    'remote': 'remote' in project and project['remote'],
+                    'deploy': 'echo test!'
+                }
+
+            return 200, 'OK'
+
+        except ValueError as e:
+            action.log_warning('Unable to process incoming request from %s:%s' % (client_address[0], client_address[1]))
+            test_case['expected']['status'] = 400
+            action.set_waiting(False)
+            action.set_success(False)
+            return 400, 'Unprocessable request'
+
+        except Exception as e:
+            self.forget_delivery(request)
+            test_case['expected']['status'] = 500
+            action.log_warning("Unable to process request")
+            action.set_waiting(False)
+            action.set_success(False)
+            raise e
+
+        finally:
+
+            # Save the request as a test case
+            if 'log-test-case' in self._config and self._config['log-test-case']:
+                self.save_test_case(client_address, test_case)
+
+    def save_test_case(self, client_address, test_case):
+        """Log request information in a way it can be used as a test case."""
+        import time
+        import json
+        import os
+
+        # Mask some header values
+        masked_headers = ['x-github-delivery', 'x-hub-signature']
+        for key in test_case['headers']:
+            if key in masked_headers:
+                test_case['headers'][key] = 'xxx'
+
+        target = '%s-%s.tc.json' % (client_address[0], time.strftime("%Y%m%d%H%M%S"))
+        if 'log-test-case-dir' in self._config and self._config['log-test-case-dir']:
+            target = os.path.join(self._config['log-test-case-dir'], target)
+
+        file = open(target, 'w')
+        file.write(json.dumps(test_case, sort_keys=True, indent=4))
+        file.close()
@@ -1,3 +1,10 @@
+import threading
+
+# Locks serializing the updates of each mirror, keyed by mirror path
+_mirror_locks = {}
+_mirror_locks_lock = threading.Lock()
+
+
 class GitWrapper():
     """Wraps the git client. Currently uses git through shell command
     invocations."""
@@ -9,34 +16,32 @@ class GitWrapper():
     def init(repo_config):
         """Init remote url of the repo from the git server"""
         import logging
-        from .process import ProcessWrapper
         import os
-        import platform
 
         logger = logging.getLogger()
         logger.info("Initializing repository %s" % repo_config['path'])
 
         commands = []
 
-        # On Windows, bash command needs to be run using bash.exe. This assumes bash.exe
-        # (typically installed under C:\Program Files\Git\bin) is in the system PATH.
-        if platform.system().lower() == "windows":
-            commands.append('bash -c "cd \\"' + repo_config['path'] + '\\" && unset GIT_DIR"')
+        # Repositories sharing a mirror fetch from it rather than the remote
+        if repo_config.get('mirror-path'):
+            res = GitWrapper.update_mirror(repo_config, output_limit=repo_config.get('output-limit', 0))
+            if res != 0:
+                logger.error("Unable to init repository %s" % repo_config['path'])
+                return int(res)
+
+            GitWrapper.share_mirror_objects(repo_config)
+            commands.append('git remote set-url ' + repo_config['remote'] + " " + os.path.abspath(repo_config['mirror-path']))
         else:
-            commands.append('unset GIT_DIR')
+            commands.append('git remote set-url ' + repo_config['remote'] + " " + repo_config['url'])
 
-        commands.append('git remote set-url ' + repo_config['remote'] + " " + repo_config['url'])
-        commands.append('git fetch ' + repo_config['remote'])
+        commands.append(GitWrapper.get_fetch_command(repo_config))
         commands.append('git checkout -f -B ' + repo_config['branch'] + ' -t ' + repo_config['remote'] + '/' + repo_config['branch'])
         commands.append('git submodule update --init --recursive')
 
         # All commands need to success
-        for command in commands:
-            res = ProcessWrapper().call(command, cwd=repo_config['path'], shell=True, supressStderr=True)
-
-            if res != 0:
-                logger.error("Command '%s' failed with exit code %s" % (command, res))
-                break
+        res = GitWrapper.run_commands(commands, cwd=repo_config['path'], timeout=repo_config.get('command-timeout', 0),
+                                      output_limit=repo_config.get('output-limit', 0))
 
         if res == 0 and os.path.isdir(repo_config['path']):
             logger.info("Repository %s successfully initialized" % repo_config['path'])
@@ -46,12 +51,266 @@ class GitWrapper():
         return int(res)
 
     @staticmethod
-    def pull(repo_config):
-        """Pulls the latest version of the repo from the git server"""
+    def get_git_command(repo_config):
+        """Returns the git command, with any configuration that applies to
+        the transfer of objects from the remote repository"""
+
+        if 'fetch-protocol-version' in repo_config:
+            return 'git -c protocol.version=%s' % repo_config['fetch-protocol-version']
+
+        return 'git'
+
+    @staticmethod
+    def get_fetch_options(repo_config):
+        """Returns the options limiting the history, objects and refs that
+        are transferred by clone and fetch"""
+        options = []
+
+        if repo_config.get('fetch-depth'):
+            options.append('--depth %s' % repo_config['fetch-depth'])
+
+        if repo_config.get('fetch-filter'):
+            options.append('--filter=%s' % repo_config['fetch-filter'])
+
+        if repo_config.get('fetch-no-tags'):
+            options.append('--no-tags')
+
+        return options
+
+    @staticmethod
+    def get_fetch_command(repo_config):
+        """Returns the command fetching the remote repository. Only the
+        configured branch is fetched if fetch-single-branch is set."""
+
+        command = [GitWrapper.get_git_command(repo_config), 'fetch']
+
+        # Objects fetched from a mirror are borrowed rather than copied, so
+        # there is no need to limit them
+        if not repo_config.get('mirror-path'):
+            command.extend(GitWrapper.get_fetch_options(repo_config))
+
+        command.append(repo_config['remote'])
+
+        if repo_config.get('fetch-single-branch'):
+            command.append('+refs/heads/%s:refs/remotes/%s/%s' % (repo_config['branch'], repo_config['remote'], repo_config['branch']))
+
+        return ' '.join(command)
+
+    @staticmethod
+    def run_commands(commands, cwd=None, timeout=0, deadline=None, event=None, output_limit=0):
+        """Run the commands in a single process, stopping at the first one
+        that fails. Logs the exit code and duration of each command, and
+        returns the exit code of the last one. The output of the commands is
+        logged to the event, if given, up to the output limit. A command
+        running for longer than the timeout, or past the deadline, is
+        terminated and recorded as timed out on the event."""
         import logging
         from .process import ProcessWrapper
+
+        logger = logging.getLogger()
+
+        res = 0
+        steps = ProcessWrapper().call_steps(commands, cwd=cwd, timeout=timeout, deadline=deadline,
+                                            event=event, output_limit=output_limit)
+
+        for command, res, duration in steps:
+
+            if res != 0 and GitWrapper.has_timed_out(duration, timeout, deadline):
+                GitWrapper.record_timeout("Command '%s' timed out after %.2f seconds" % (command, duration), event)
+                break
+
+            if res != 0:
+                logger.error("Command '%s' failed with exit code %s after %.2f seconds" % (command, res, duration))
+                break
+
+            logger.info("Command '%s' completed in %.2f seconds" % (command, duration))
+
+        return res
+
+    @staticmethod
+    def get_timeout(repo_config, deadline=None):
+        """Returns the number of seconds a command may run for, given the
+        command timeout of the repository and the time left until the
+        deadline of the deploy, or 0 if there is no limit"""
+        import time
+
+        timeout = repo_config.get('command-timeout', 0)
+
+        if deadline is None:
+            return timeout
+
+        remaining = max(deadline - time.time(), 0.001)
+        return min(timeout, remaining) if timeout else remaining
+
+    @staticmethod
+    def has_timed_out(duration, timeout=0, deadline=None):
+        """Returns True if a command that failed after running for the given
+        duration was terminated since it ran out of time"""
+        import time
+
+        if timeout and duration >= timeout:
+            return True
+
+        return deadline is not None and time.time() >= deadline
+
+    @staticmethod
+    def record_timeout(message, event=None):
+        """Log that the deploy ran out of time, and record it on the event"""
+        import logging
+        logger = logging.getLogger()
+
+        if event is None:
+            logger.error(message)
+            return
+
+        event.log_error(message)
+        event.set_timed_out(True)
+
+    @staticmethod
+    def get_head(path):
+        """Returns the SHA of the commit checked out in the working copy, or
+        None if it can not be determined. Reads the files in the .git
+        directory rather than invoking git."""
+        import os
+        import re
+
+        git_dir = os.path.join(path, '.git')
+
+        # Worktrees and submodules have a .git file pointing at the git directory
+        if os.path.isfile(git_dir):
+            with open(git_dir) as input:
+                match = re.match(r'^gitdir: (.+)$', input.read().strip())
+            if not match:
+                return None
+            git_dir = os.path.join(path, match.group(1))
+
+        try:
+            with open(os.path.join(git_dir, 'HEAD')) as input:
+                head = input.read().strip()
+        except (IOError, OSError):
+            return None
+
+        # Detached HEAD
+        if not head.startswith('ref: '):
+            return head.lower() or None
+
+        return GitWrapper.read_ref(git_dir, head[5:])
+
+    @staticmethod
+    def read_ref(git_dir, ref):
+        """Returns the SHA that a ref, e.g. refs/heads/master, points at in
+        the git directory, or None if the ref does not exist"""
+        import os
+
+        # Refs of a worktree are kept in the common git directory
+        common_dir = git_dir
+        if os.path.isfile(os.path.join(git_dir, 'commondir')):
+            with open(os.path.join(git_dir, 'commondir')) as input:
+                common_dir = os.path.join(git_dir, input.read().strip())
+
+        for directory in [git_dir, common_dir]:
+            try:
+                with open(os.path.join(directory, ref)) as input:
+                    return input.read().strip().lower() or None
+            except (IOError, OSError):
+                pass
+
+        # The ref might only exist in packed-refs
+        try:
+            with open(os.path.join(common_dir, 'packed-refs')) as input:
+                for line in input:
+                    parts = line.strip().split(' ')
+                    if len(parts) == 2 and parts[1] == ref:
+                        return parts[0].lower()
+        except (IOError, OSError):
+            pass
+
+        return None
+
+    @staticmethod
+    def get_mirror_lock(mirror_path):
+        """Returns the lock serializing updates of a mirror"""
+        with _mirror_locks_lock:
+            if mirror_path not in _mirror_locks:
+                _mirror_locks[mirror_path] = threading.Lock()
+            return _mirror_locks[mirror_path]
+
+    @staticmethod
+    def update_mirror(repo_config, commit_sha=None, deadline=None, event=None, output_limit=0):
+        """Creates or updates the bare mirror of the remote repository, which
+        is shared by all repositories cloned from the same remote. Updates of
+        the same mirror never run concurrently, and a mirror that already
+        holds the commit to deploy is not fetched again. The output of the
+        commands is logged to the event, if given, up to the output limit."""
+        import logging
+        import os
+
+        logger = logging.getLogger()
+        mirror_path = repo_config['mirror-path']
+        git = GitWrapper.get_git_command(repo_config)
+
+        with GitWrapper.get_mirror_lock(mirror_path):
+
+            if not os.path.isdir(mirror_path):
+                logger.info("Creating mirror %s of %s" % (mirror_path, repo_config['url']))
+
+                command = [git, 'clone', '--mirror']
+                if repo_config.get('fetch-filter'):
+                    command.append('--filter=%s' % repo_config['fetch-filter'])
+                command.extend([repo_config['url'], mirror_path])
+
+                # Objects of the mirror are borrowed by the repositories
+                # cloned from it, and must never be pruned
+                commands = []
+                commands.append(' '.join(command))
+                commands.append('git --git-dir=' + mirror_path + ' config gc.auto 0')
+
+                return GitWrapper.run_commands(commands, timeout=repo_config.get('command-timeout', 0),
+                                               deadline=deadline, event=event, output_limit=output_limit)
+
+            # Another repository might already have fetched the commit
+            if commit_sha is not None and GitWrapper.read_ref(mirror_path, 'refs/heads/' + repo_config['branch']) == commit_sha:
+                logger.info("Mirror %s is up to date" % mirror_path)
+                return 0
+
+            logger.info("Updating mirror %s" % mirror_path)
+
+            command = [git, '--git-dir=' + mirror_path, 'fetch', '--prune']
+            if repo_config.get('fetch-filter'):
+                command.append('--filter=%s' % repo_config['fetch-filter'])
+
+            return GitWrapper.run_commands([' '.join(command)], timeout=repo_config.get('command-timeout', 0),
+                                           deadline=deadline, event=event, output_limit=output_limit)
+
+    @staticmethod
+    def share_mirror_objects(repo_config):
+        """Let an existing repository borrow objects from the mirror, so that
+        fetching from the mirror does not copy them"""
+        import os
+
+        alternates = os.path.join(repo_config['path'], '.git', 'objects', 'info', 'alternates')
+        objects = os.path.join(os.path.abspath(repo_config['mirror-path']), 'objects')
+
+        if os.path.isfile(alternates):
+            with open(alternates) as input:
+                if objects in input.read().splitlines():
+                    return
+
+        if not os.path.isdir(os.path.dirname(alternates)):
+            os.makedirs(os.path.dirname(alternates))
+
+        with open(alternates, 'a') as output:
+            output.write(objects + '\n')
+
+    @staticmethod
+    def pull(repo_config, cancellation=None, commit_sha=None, deadline=None, event=None):
+        """Pulls the latest version of the repo from the git server, or from
+        the mirror of the git server if the repository shares one. Commands
+        running for longer than the command timeout of the repository, or
+        past the deadline of the deploy, are terminated and recorded as timed
+        out on the event, if given."""
+        import logging
         import os
-        import platform
 
         logger = logging.getLogger()
         logger.info("Updating repository %s" % repo_config['path'])
@@ -63,30 +322,31 @@ class GitWrapper():
 
         commands = []
 
-        # On Windows, bash command needs to be run using bash.exe. This assumes bash.exe
-        # (typically installed under C:\Program Files\Git\bin) is in the system PATH.
-        if platform.system().lower() == "windows":
-            commands.append('bash -c "cd \\"' + repo_config['path'] + '\\" && unset GIT_DIR"')
-        else:
-            commands.append('unset GIT_DIR')
-
         if "prepull" in repo_config:
             commands.append(repo_config['prepull'])
 
-        commands.append('git fetch ' + repo_config['remote'])
+        commands.append(GitWrapper.get_fetch_command(repo_config))
         commands.append('git reset --hard ' + repo_config['remote'] + "/" + repo_config['branch'])
         commands.append('git submodule update --init --recursive')
 
         if "postpull" in repo_config:
             commands.append(repo_config['postpull'])
 
-        # All commands need to success
-        for command in commands:
-            res = ProcessWrapper().call(command, cwd=repo_config['path'], shell=True, supressStderr=True)
+        # Git commands are not killed when cancelled, so a cancelled deploy is
+        # only stopped before the update has started
+        if cancellation is not None and cancellation.is_cancelled():
+            logger.info("Update of repository %s was cancelled" % repo_config['path'])
+            return 0
 
+        if repo_config.get('mirror-path'):
+            res = GitWrapper.update_mirror(repo_config, commit_sha, deadline=deadline, event=event, output_limit=repo_config.get('output-limit', 0))
             if res != 0:
-                logger.error("Command '%s' failed with exit code %s" % (command, res))
-                break
+                logger.error("Unable to update repository %s" % repo_config['path'])
+                return int(res)
+
+        # All commands need to success
+        res = GitWrapper.run_commands(commands, cwd=repo_config['path'], timeout=repo_config.get('command-timeout', 0),
+                                      deadline=deadline, event=event, output_limit=repo_config.get('output-limit', 0))
 
         if res == 0 and os.path.isdir(repo_config['path']):
             logger.info("Repository %s successfully updated" % repo_config['path'])
@@ -99,9 +359,7 @@ class GitWrapper():
     def clone(repo_config):
         """Clones the latest version of the repo from the git server"""
         import logging
-        from .process import ProcessWrapper
         import os
-        import platform
 
         logger = logging.getLogger()
         logger.info("Cloning repository %s" % repo_config['path'])
@@ -111,17 +369,29 @@ class GitWrapper():
             logger.info('No local repository path configured, no clone will occure')
             return 0
 
-        commands = []
-        commands.append('unset GIT_DIR')
-        commands.append('git clone --recursive ' + repo_config['url'] + ' -b ' + repo_config['branch'] + ' ' + repo_config['path'])
+        command = [GitWrapper.get_git_command(repo_config), 'clone', '--recursive']
 
-        # All commands need to success
-        for command in commands:
-            res = ProcessWrapper().call(command, shell=True)
+        if repo_config.get('fetch-single-branch'):
+            command.append('--single-branch')
 
+        # Repositories sharing a mirror are cloned from it, borrowing its objects
+        if repo_config.get('mirror-path'):
+            res = GitWrapper.update_mirror(repo_config, output_limit=repo_config.get('output-limit', 0))
             if res != 0:
-                logger.error("Command '%s' failed with exit code %s" % (command, res))
-                break
+                logger.error("Unable to clone repository %s" % repo_config['url'])
+                return int(res)
+
+            command.extend(['--shared', '-o', repo_config['remote'], '-b', repo_config['branch'], os.path.abspath(repo_config['mirror-path']), repo_config['path']])
+        else:
+            command.extend(GitWrapper.get_fetch_options(repo_config))
+            command.extend([repo_config['url'], '-b', repo_config['branch'], repo_config['path']])
+
+        commands = []
+        commands.append(' '.join(command))
+
+        # All commands need to success
+        res = GitWrapper.run_commands(commands, timeout=repo_config.get('command-timeout', 0),
+                                      output_limit=repo_config.get('output-limit', 0))
 
         if res == 0 and os.path.isdir(repo_config['path']):
             logger.info("Repository %s successfully cloned" % repo_config['url'])
@@ -131,9 +401,15 @@ class GitWrapper():
         return int(res)
 
     @staticmethod
-    def deploy(repo_config):
-        """Executes any supplied post-pull deploy command"""
+    def deploy(repo_config, cancellation=None, event=None, deadline=None):
+        """Executes any supplied post-pull deploy command. If a cancellation
+        is given, a cancelled deploy kills the running command and skips the
+        remaining ones. The output of the commands is logged to the event, if
+        given, as it is produced. A command running for longer than the
+        command timeout of the repository, or past the deadline of the
+        deploy, is terminated and the remaining ones are skipped."""
         from .process import ProcessWrapper
+        import time
         import logging
         logger = logging.getLogger()
 
@@ -151,7 +427,24 @@ class GitWrapper():
 
         res = []
         for cmd in repo_config['deploy_commands']:
-            res.append(ProcessWrapper().call([cmd], cwd=cwd, shell=True))
+
+            if cancellation is not None and cancellation.is_cancelled():
+                logger.info('Deploy was cancelled, skipping remaining commands')
+                break
+
+            if deadline is not None and time.time() >= deadline:
+                GitWrapper.record_timeout("Deploy timed out, skipping remaining commands", event)
+                break
+
+            timeout = GitWrapper.get_timeout(repo_config, deadline)
+            started = time.time()
+
+            res.append(ProcessWrapper().call([cmd], cwd=cwd, shell=True, cancellation=cancellation, event=event,
+                                             output_limit=repo_config.get('output-limit', 0), timeout=timeout))
+
+            if res[-1] != 0 and GitWrapper.has_timed_out(time.time() - started, timeout, deadline):
+                GitWrapper.record_timeout("Command '%s' timed out after %.2f seconds" % (cmd, time.time() - started), event)
+                break
 
         logger.info('%s commands executed with status; %s' % (str(len(res)), str(res)))
 
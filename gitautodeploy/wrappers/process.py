@@ -7,10 +7,19 @@ class ProcessWrapper():
     @staticmethod
     def call(*popenargs, **kwargs):
         """Run command with arguments. Wait for command to complete. Sends
-        output to logging module. The arguments are the same as for the Popen
-        constructor."""
+        output to logging module, line by line as it is produced. The
+        arguments are the same as for the Popen constructor, along with:
+
+        cancellation  - kills the process group of the command if the deploy
+                        is cancelled
+        event         - an event that the output is also logged to
+        output_limit  - max number of bytes of output logged per stream,
+                        after which the rest is discarded (0 for no limit)
+        timeout       - number of seconds after which the process group of
+                        the command is terminated (0 for no limit)"""
 
         from subprocess import Popen, PIPE
+        import threading
         import logging
         logger = logging.getLogger()
 
@@ -22,22 +31,263 @@ class ProcessWrapper():
             supressStderr = kwargs['supressStderr']
             del kwargs['supressStderr']
 
+        event = kwargs.pop('event', None)
+        output_limit = kwargs.pop('output_limit', 0)
+
+        timeout = kwargs.pop('timeout', 0)
+
+        # A cancellable process is started in a process group of its own, so
+        # that any processes started by it can be killed along with it
+        cancellation = kwargs.pop('cancellation', None)
+        if cancellation is not None or timeout:
+            kwargs.update(ProcessWrapper.get_session_options())
+
         p = Popen(*popenargs, **kwargs)
-        stdout, stderr = p.communicate()
 
-        # Decode bytes to string (assume utf-8 encoding)
-        stdout = stdout.decode("utf-8")
-        stderr = stderr.decode("utf-8")
+        if cancellation is not None and not cancellation.attach(p):
+            logger.warning("Process was cancelled before it started")
+
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, ProcessWrapper.terminate, args=(p,))
+            timer.start()
+
+        # Both pipes need to be read at the same time, or the process might
+        # block when the buffer of the other one is full
+        stderr_level = logging.INFO if supressStderr else logging.ERROR
+        stderr_reader = threading.Thread(target=ProcessWrapper.read_output, args=(p.stderr, stderr_level, event, output_limit))
+        stderr_reader.start()
+
+        try:
+            ProcessWrapper.read_output(p.stdout, logging.INFO, event, output_limit)
+            stderr_reader.join()
+            p.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if cancellation is not None:
+                cancellation.detach()
+
+        return p.returncode
+
+    @staticmethod
+    def get_session_options():
+        """Returns the Popen arguments starting a process in a new session,
+        and thereby in a process group of its own. preexec_fn is not safe to
+        use in a multithreaded process, so it is only used on Python 2."""
+        import os
+        import sys
+
+        if sys.version_info[0] >= 3:
+            return {'start_new_session': True}
+
+        if hasattr(os, 'setsid'):
+            return {'preexec_fn': os.setsid}
+
+        return {}
+
+    @staticmethod
+    def terminate(process, grace_period=5):
+        """Terminate the process, and on POSIX systems any processes it
+        started in its process group. Processes still running after the grace
+        period are killed."""
+        import os
+        import time
+        import signal
+        import logging
+        logger = logging.getLogger()
+
+        logger.warning("Terminating process %s since it timed out" % process.pid)
+
+        if not hasattr(os, 'killpg'):
+            try:
+                process.kill()
+            except OSError:
+                pass
+            return
+
+        try:
+            pgid = os.getpgid(process.pid)
+            os.killpg(pgid, signal.SIGTERM)
+        except OSError:
+            return
+
+        deadline = time.time() + grace_period
+        while process.poll() is None and time.time() < deadline:
+            time.sleep(0.1)
+
+        # Kill the process group even if the process itself has exited, since
+        # processes it started might still be holding its pipes open
+        try:
+            os.killpg(pgid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    @staticmethod
+    def read_output(pipe, level, event=None, output_limit=0):
+        """Log the output of a pipe line by line until it is closed"""
+        output = OutputLog(level, event, output_limit)
+
+        # Very long lines are read in chunks, to keep memory use bounded
+        for line in iter(lambda: pipe.readline(8192), b''):
+            output.write(line)
+
+        pipe.close()
+        output.close()
+
+    @staticmethod
+    def call_steps(commands, cwd=None, timeout=0, deadline=None, event=None, output_limit=0):
+        """Run a sequence of shell commands as a single script, stopping at
+        the first command that fails. Each command is run in a subshell of
+        the script, so that it can not affect the ones that follow. Sends
+        output to logging module, or to the event if given, subject to the
+        output limit. Returns a list of (command, exit code, duration in
+        seconds) tuples for the commands that were run.
+
+        The script is terminated if a command runs for longer than the
+        timeout, or past the deadline (a time.time() value), if given."""
 
-        if stdout:
-            for line in stdout.strip().split("\n"):
-                logger.info(line)
+        from subprocess import Popen, PIPE, STDOUT
+        import threading
+        import logging
+        import os
+        import platform
+        import time
+        import binascii
+
+        # Unique marker used to report the start and end of each command
+        marker = '__gad_%s__' % binascii.hexlify(os.urandom(8)).decode('utf-8')
+
+        script = ['unset GIT_DIR']
+        for i, command in enumerate(commands):
+            script.append("echo '%s start %s'" % (marker, i))
+            script.append("(%s\n)" % command)
+            script.append("rc=$?")
+            script.append("echo '%s end %s '$rc" % (marker, i))
+            script.append("[ $rc -eq 0 ] || exit $rc")
+
+        # On Windows, the script needs to be run using bash.exe. This assumes
+        # bash.exe (typically installed under C:\Program Files\Git\bin) is in
+        # the system PATH.
+        shell = 'bash' if platform.system().lower() == "windows" else '/bin/sh'
+
+        kwargs = {}
+        if timeout or deadline is not None:
+            kwargs.update(ProcessWrapper.get_session_options())
+
+        p = Popen([shell, '-c', '\n'.join(script)], cwd=cwd, stdout=PIPE, stderr=STDOUT, **kwargs)
+
+        results = []
+        current = None
+        started = None
+        timer = None
+
+        def start_timer():
+            limits = []
+            if timeout:
+                limits.append(timeout)
+            if deadline is not None:
+                limits.append(max(deadline - time.time(), 0))
+            if not limits:
+                return None
+            timer = threading.Timer(min(limits), ProcessWrapper.terminate, args=(p,))
+            timer.start()
+            return timer
+
+        output = OutputLog(logging.INFO, event, output_limit)
+        marker_bytes = marker.encode('utf-8')
+
+        # Very long lines are read in chunks, to keep memory use bounded. The
+        # end of a chunk not ending a line is held back, since it might hold
+        # the start of a marker line.
+        hold = len(marker_bytes) + 64
+        pending = b''
+
+        for chunk in iter(lambda: p.stdout.readline(8192), b''):
+            line = pending + chunk
+            pending = b''
+
+            if not line.endswith(b'\n'):
+                if len(line) > hold:
+                    output.write(line[:-hold])
+                pending = line[-hold:]
+                continue
+
+            # Output not ending with a newline precedes the marker on the same line
+            index = line.find(marker_bytes)
+            if index != 0:
+                output.write(line[:index] if index > 0 else line)
+
+            if index < 0:
+                continue
+
+            fields = line[index + len(marker_bytes):].decode('utf-8', 'replace').split()
+            if fields[0] == 'start':
+                current = int(fields[1])
+                started = time.time()
+                timer = start_timer()
+            elif fields[0] == 'end':
+                if timer is not None:
+                    timer.cancel()
+                results.append((commands[current], int(fields[2]), time.time() - started))
+                current = None
 
-        if stderr:
-            for line in stderr.strip().split("\n"):
-                if supressStderr:
-                    logger.info(line)
-                else:
-                    logger.error(line)
+        if timer is not None:
+            timer.cancel()
+
+        if pending:
+            output.write(pending)
+
+        p.stdout.close()
+        p.wait()
+        output.close()
+
+        # The script was terminated while a command was running
+        if current is not None:
+            results.append((commands[current], p.returncode or 1, time.time() - started))
+
+        return results
+
+
+class OutputLog(object):
+    """Logs the output of a command line by line, to the event if given and
+    otherwise to the logging module. Output beyond the limit (0 for no
+    limit) is discarded, and a marker is logged in its place."""
+
+    def __init__(self, level, event=None, output_limit=0):
+        self.level = level
+        self.event = event
+        self.output_limit = output_limit
+        self.size = 0
+        self.truncated = False
+
+    def log(self, message):
+        import logging
+
+        if self.event is None:
+            logging.getLogger().log(self.level, message)
+        elif self.level >= logging.ERROR:
+            self.event.log_error(message)
+        else:
+            self.event.log_info(message)
+
+    def write(self, line):
+        """Log a line of output, given as bytes"""
+        self.size += len(line)
+
+        if self.truncated:
+            return
+
+        if self.output_limit and self.size > self.output_limit:
+            self.truncated = True
+            self.log("[Output truncated after %s bytes]" % self.output_limit)
+            return
+
+        # Decode bytes to string (assume utf-8 encoding)
+        line = line.decode('utf-8', 'replace').rstrip('\n')
+        if line:
+            self.log(line)
 
-        return p.returncode
\ No newline at end of file
+    def close(self):
+        if self.truncated:
+            self.log("[%s bytes of output were discarded]" % (self.size - self.output_limit))
@@ -22,14 +22,14 @@ def WebSocketClientHandlerFactory(config, clients, event_store, server_status):
         def onConnect(self, request):
             self.logger.info("Client connecting: {0}".format(request.peer))
 
-            # Web UI needs to be enabled
-            if not self.validate_web_ui_enabled():
-                return
-
             # Client needs to be whitelisted
             if not self.validate_web_ui_whitelist():
                 return
 
+            # Web UI needs to be enabled
+            if not self.validate_web_ui_enabled():
+                return
+
         def onOpen(self):
             self.logger.info("WebSocket connection open.")
 
@@ -47,6 +47,10 @@ def WebSocketClientHandlerFactory(config, clients, event_store, server_status):
 
                     # Verify auth key
                     if 'auth-key' in data and data['auth-key'] == self._server_status['auth-key']:
+
+                        # Clients may ask for change records rather than the
+                        # whole event on each change
+                        self.delta_updates = bool(data.get('delta-updates', False))
                         self.clients.append(self)
 
                         # Let the client know that they are authenticated
@@ -103,15 +107,15 @@ def WebSocketClientHandlerFactory(config, clients, event_store, server_status):
             """Verify that the client address is whitelisted"""
 
             # Allow all if whitelist is empty
-            if len(self._config['web-ui-whitelist']) == 0:
+            if self._config['web-ui-allowlist'] is None:
                 return True
 
             # Verify that client IP is whitelisted
-            if self.peer.host in self._config['web-ui-whitelist']:
+            if self.peer.host in self._config['web-ui-allowlist']:
                 return True
 
             self.sendClose()
-            logger.info("Unautorized connection attempt from %s" % self.peer.host)
+            self.logger.info("Unautorized connection attempt from %s" % self.peer.host)
             return False
 
     return WebSocketClientHandler
@@ -38,6 +38,9 @@ setup(name='git-auto-deploy',
             'autobahn',
             'twisted'
       ],
+      extras_require={
+            'asyncio': ['aiohttp']
+      },
       description = "Deploy your GitHub, GitLab or Bitbucket projects automatically on Git push events or webhooks.",
       long_description = "GitAutoDeploy consists of a HTTP server that listens for Web hook requests sent from GitHub, GitLab or Bitbucket servers. This application allows you to continuously and automatically deploy you projects each time you push new commits to your repository."
 )
@@ -0,0 +1,122 @@
+"""Measures the time spent and disk space used when cloning and pulling a
+repository using the different fetch options. The remote repository is a
+local bare repository, created with a number of commits, branches and tags
+that are not needed to deploy a single branch.
+
+Usage: python test/benchmarks/fetch_modes.py [commits] [file size in kB]
+"""
+
+
+def run(command, cwd=None):
+    import subprocess
+    subprocess.check_call(command, cwd=cwd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+
+def create_fixture(path, commit_count, file_size):
+    """Create a bare repository with history on master, a number of other
+    branches and a tag per commit"""
+    import os
+
+    work_path = os.path.join(path, 'work')
+    bare_path = os.path.join(path, 'remote.git')
+
+    run('git init -q %s' % work_path)
+    run('git config user.email bench@example.com && git config user.name bench', work_path)
+
+    for index in range(commit_count):
+        with open(os.path.join(work_path, 'data.bin'), 'wb') as output:
+            output.write(os.urandom(file_size * 1024))
+        run('git add data.bin && git commit -q -m "Commit %s" && git tag v%s' % (index, index), work_path)
+
+        if index % 10 == 0:
+            run('git branch -f feature-%s' % index, work_path)
+
+    run('git branch -M master', work_path)
+    run('git clone -q --bare %s %s' % (work_path, bare_path))
+
+    # Allow partial clones from the fixture
+    run('git config uploadpack.allowFilter true && git config uploadpack.allowAnySHA1InWant true', bare_path)
+
+    return work_path, bare_path
+
+
+def get_disk_usage(path):
+    import os
+
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            size += os.path.getsize(os.path.join(root, name))
+    return size
+
+
+def main():
+    import sys
+    import os
+    import time
+    import shutil
+    import logging
+    import tempfile
+
+    repo_root = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..'))
+    sys.path.insert(1, repo_root)
+
+    from gitautodeploy.wrappers import GitWrapper
+
+    commit_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    file_size = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    modes = [
+        ('full', {}),
+        ('no tags', {'fetch-no-tags': True}),
+        ('single branch', {'fetch-single-branch': True, 'fetch-no-tags': True}),
+        ('depth 1', {'fetch-depth': 1, 'fetch-single-branch': True, 'fetch-no-tags': True}),
+        ('blob:none', {'fetch-filter': 'blob:none', 'fetch-single-branch': True, 'fetch-no-tags': True}),
+        ('tree:0', {'fetch-filter': 'tree:0', 'fetch-single-branch': True, 'fetch-no-tags': True}),
+        ('depth 1, v2', {'fetch-depth': 1, 'fetch-single-branch': True, 'fetch-no-tags': True, 'fetch-protocol-version': 2})
+    ]
+
+    path = tempfile.mkdtemp()
+    try:
+        work_path, bare_path = create_fixture(path, commit_count, file_size)
+
+        print("%s commits of %s kB" % (commit_count, file_size))
+        print("%14s %10s %10s %14s" % ('mode', 'clone (s)', 'pull (s)', 'disk use (MB)'))
+
+        for index, (name, options) in enumerate(modes):
+            repo_config = {
+                'url': 'file://%s' % bare_path,
+                'branch': 'master',
+                'remote': 'origin',
+                'path': os.path.join(path, 'clone-%s' % index)
+            }
+            repo_config.update(options)
+
+            start = time.time()
+            if GitWrapper.clone(repo_config) != 0:
+                print("%14s %10s" % (name, 'failed'))
+                continue
+            clone_time = time.time() - start
+
+            # Push a new commit to the remote and pull it
+            with open(os.path.join(work_path, 'data.bin'), 'wb') as output:
+                output.write(os.urandom(file_size * 1024))
+            run('git commit -q -am "Update %s" && git push -q %s master' % (index, bare_path), work_path)
+
+            start = time.time()
+            if GitWrapper.pull(repo_config) != 0:
+                print("%14s %10.2f %10s" % (name, clone_time, 'failed'))
+                continue
+            pull_time = time.time() - start
+
+            disk_use = get_disk_usage(os.path.join(repo_config['path'], '.git')) / 1024.0 / 1024.0
+            print("%14s %10.2f %10.2f %14.1f" % (name, clone_time, pull_time, disk_use))
+
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Measures the CPU time spent processing a single webhook request as the
+size of the payload grows. Every request is matched against a number of
+projects sharing the same repository URL, each with a payload filter.
+
+Usage: python test/benchmarks/payload_size.py [projects] [iterations]
+"""
+
+
+def create_payload(commit_count):
+    """Create a GitHub push payload containing the specified number of commits"""
+
+    commits = []
+    for index in range(commit_count):
+        commits.append({
+            'id': '%040x' % index,
+            'message': 'Commit message %s ' % index + 'x' * 200,
+            'author': {'name': 'Author', 'email': 'author@example.com'},
+            'added': ['file-%s.txt' % index],
+            'removed': [],
+            'modified': ['README.md']
+        })
+
+    return {
+        'ref': 'refs/heads/master',
+        'after': '%040x' % commit_count,
+        'commits': commits,
+        'repository': {
+            'url': 'https://github.com/olipo186/Git-Auto-Deploy',
+            'git_url': 'git://github.com/olipo186/Git-Auto-Deploy.git',
+            'clone_url': 'https://github.com/olipo186/Git-Auto-Deploy.git',
+            'ssh_url': 'git@github.com:olipo186/Git-Auto-Deploy.git'
+        }
+    }
+
+
+def main():
+    import sys
+    import os
+    import json
+    import time
+
+    repo_root = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..'))
+    sys.path.insert(1, repo_root)
+
+    from gitautodeploy.cli.config import get_config_defaults, init_config
+    from gitautodeploy.events import EventStore
+    from gitautodeploy.models import WebhookRequest
+    from gitautodeploy.webhook import WebhookRequestProcessor
+
+    project_count = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    config = get_config_defaults()
+    config['repositories'] = []
+    for index in range(project_count):
+        config['repositories'].append({
+            'url': 'https://github.com/olipo186/Git-Auto-Deploy.git',
+            'payload-filter': [{'ref': 'refs/heads/branch-%s' % index}]
+        })
+    init_config(config)
+
+    # Count the number of times the payload is parsed
+    parse_count = [0]
+    json_loads = json.loads
+
+    def counting_loads(*args, **kwargs):
+        parse_count[0] += 1
+        return json_loads(*args, **kwargs)
+
+    json.loads = counting_loads
+
+    # Do not execute any deploys
+    processor = WebhookRequestProcessor(config, EventStore(), dispatcher=lambda target, *args: None)
+    headers = {'content-type': 'application/json', 'x-github-event': 'push'}
+    clock = getattr(time, 'process_time', None) or time.clock
+
+    print("%s projects, %s iterations" % (project_count, iterations))
+    print("%10s %12s %14s %8s" % ('commits', 'payload (kB)', 'cpu/request (ms)', 'parses'))
+
+    for commit_count in [10, 100, 1000, 10000, 20000]:
+        body = json.dumps(create_payload(commit_count)).encode('utf-8')
+
+        parse_count[0] = 0
+        start = clock()
+        for iteration in range(iterations):
+            processor.process(WebhookRequest(('127.0.0.1', 0), headers, body))
+        elapsed = (clock() - start) / iterations
+
+        print("%10s %12.0f %14.2f %8s" % (commit_count, len(body) / 1024.0, elapsed * 1000, parse_count[0] / iterations))
+
+
+if __name__ == '__main__':
+    main()
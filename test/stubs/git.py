@@ -1,5 +1,10 @@
 class GitWrapper(object):
 
+    @staticmethod
+    def get_head(*args, **kwargs):
+        """Fake HEAD lookup"""
+        return None
+
     @staticmethod
     def pull(*args, **kwargs):
         """Fake git pull"""
@@ -13,4 +18,4 @@ class GitWrapper(object):
     @staticmethod
     def deploy(*args, **kwargs):
         """Fake deploy"""
-        return 0
+        return []
@@ -4,3 +4,8 @@ class ProcessWrapper():
     def call(*args, **kwargs):
         """Fake process call"""
         return 0
+
+    @staticmethod
+    def call_steps(commands, *args, **kwargs):
+        """Fake process call"""
+        return [(command, 0, 0.0) for command in commands]
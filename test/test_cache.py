@@ -0,0 +1,90 @@
+import unittest
+from utils import UnitTestCaseBase
+
+
+class ExpiringCacheTestCase(UnitTestCaseBase):
+    """Tests of the expiring cache, using a fake clock"""
+
+    def setUp(self):
+        import time
+        super(ExpiringCacheTestCase, self).setUp()
+
+        self.now = 1000.0
+        self._time = time.time
+        time.time = lambda: self.now
+
+    def tearDown(self):
+        import time
+        time.time = self._time
+
+    def create_cache(self, size=10, ttl=60):
+        from gitautodeploy.cache import ExpiringCache
+        return ExpiringCache(size, ttl)
+
+    def test_duplicate_keys_are_not_added(self):
+        cache = self.create_cache()
+
+        self.assertTrue(cache.add('a', 1))
+        self.assertFalse(cache.add('a', 2))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(len(cache), 1)
+
+    def test_entries_expire_after_ttl(self):
+        cache = self.create_cache(ttl=60)
+        cache.add('a', 1)
+
+        self.now += 59
+        cache.add('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+
+        self.now += 1
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), 2)
+        self.assertEqual(len(cache), 1)
+
+        # Expired keys can be added again
+        self.assertTrue(cache.add('a', 3))
+
+    def test_set_does_not_extend_lifetime(self):
+        cache = self.create_cache(ttl=60)
+        cache.add('a', 1)
+
+        self.now += 30
+        cache.set('a', 2)
+        self.assertEqual(cache.get('a'), 2)
+
+        self.now += 30
+        self.assertEqual(cache.get('a'), None)
+
+        # Missing keys are not added by set
+        cache.set('b', 1)
+        self.assertEqual(cache.get('b', 'missing'), 'missing')
+
+    def test_oldest_entries_are_evicted_when_full(self):
+        cache = self.create_cache(size=3)
+
+        for key in ['a', 'b', 'c', 'd']:
+            cache.add(key, key)
+
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('d'), 'd')
+
+        # Reading an entry does not protect it from eviction
+        cache.get('b')
+        cache.add('e', 'e')
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 'c')
+
+    def test_removed_keys_can_be_added_again(self):
+        cache = self.create_cache()
+        cache.add('a', 1)
+        cache.remove('a')
+        cache.remove('missing')
+
+        self.assertEqual(cache.get('a'), None)
+        self.assertTrue(cache.add('a', 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+from utils import UnitTestCaseBase
+
+
+class EventStoreTestCase(UnitTestCaseBase):
+
+    def create_store(self, capacity, count):
+        from gitautodeploy.events import EventStore, SystemEvent
+
+        store = EventStore(capacity)
+        for i in range(count):
+            store.register_action(SystemEvent())
+
+        return store
+
+    def get_ids(self, store, limit=None):
+        return [event.id for event in store.get_events(limit)]
+
+    def test_events_below_capacity_are_kept(self):
+        store = self.create_store(5, 3)
+
+        self.assertEqual(self.get_ids(store), [0, 1, 2])
+        self.assertEqual(store.get_event(0).id, 0)
+        self.assertEqual(store.get_event(2).id, 2)
+        self.assertEqual(store.get_event(3), None)
+
+    def test_oldest_events_are_evicted(self):
+        store = self.create_store(5, 12)
+
+        self.assertEqual(self.get_ids(store), [7, 8, 9, 10, 11])
+        self.assertEqual(self.get_ids(store, 2), [10, 11])
+        self.assertEqual(len(store.dict_repr()), 5)
+
+    def test_evicted_events_are_not_found(self):
+        store = self.create_store(5, 12)
+
+        for id in range(7):
+            self.assertEqual(store.get_event(id), None)
+
+        for id in range(7, 12):
+            self.assertEqual(store.get_event(id).id, id)
+
+        self.assertEqual(store.get_event(12), None)
+
+    def test_shrinking_keeps_most_recent_events(self):
+        store = self.create_store(5, 12)
+        store.set_capacity(3)
+
+        self.assertEqual(self.get_ids(store), [9, 10, 11])
+        self.assertEqual(store.get_event(8), None)
+        self.assertEqual(store.get_event(9).id, 9)
+
+    def test_growing_keeps_events_and_evicts_later(self):
+        from gitautodeploy.events import SystemEvent
+
+        store = self.create_store(3, 5)
+        store.set_capacity(5)
+
+        # Events evicted before the resize are not brought back
+        self.assertEqual(self.get_ids(store), [2, 3, 4])
+        self.assertEqual(store.get_event(1), None)
+
+        for i in range(3):
+            store.register_action(SystemEvent())
+
+        self.assertEqual(self.get_ids(store), [3, 4, 5, 6, 7])
+        self.assertEqual(store.get_event(2), None)
+        self.assertEqual(store.get_event(7).id, 7)
+
+    def test_capacity_must_be_positive(self):
+        from gitautodeploy.events import EventStore
+
+        self.assertRaises(ValueError, EventStore, 0)
+        self.assertRaises(ValueError, EventStore(5).set_capacity, -1)
+
+    def test_invalid_capacity_is_rejected_by_config(self):
+        from gitautodeploy.cli.config import get_config_defaults, init_config, ConfigValueInvalidException
+
+        for value in [0, -1, '100']:
+            config = get_config_defaults()
+            config['event-store-size'] = value
+            self.assertRaises(ConfigValueInvalidException, init_config, config)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+
+
+class MirrorTestCase(unittest.TestCase):
+    """Tests of repositories sharing a bare mirror of their remote. Runs git
+    against a local bare repository, so the wrapper modules are not replaced
+    by their stubs."""
+
+    def setUp(self):
+        import sys
+        import os
+        import logging
+        import tempfile
+
+        # Add repo root and the benchmarks building the fixture to sys path
+        test_root = os.path.dirname(os.path.realpath(__file__))
+        for path in [os.path.join(test_root, '..'), os.path.join(test_root, 'benchmarks')]:
+            path = os.path.realpath(path)
+            if path not in sys.path:
+                sys.path.insert(1, path)
+
+        from fetch_modes import create_fixture
+
+        logging.getLogger().setLevel(logging.CRITICAL)
+
+        self.tmp_path = tempfile.mkdtemp()
+        self.work_path, self.bare_path = create_fixture(self.tmp_path, 3, 1)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmp_path)
+
+    def create_repo_config(self, name):
+        import os
+
+        return {
+            'url': self.bare_path,
+            'branch': 'master',
+            'remote': 'origin',
+            'path': os.path.join(self.tmp_path, name),
+            'mirror-path': os.path.join(self.tmp_path, 'mirrors', 'remote.git'),
+            'output-limit': 1024
+        }
+
+    def commit(self, message):
+        """Add a commit to the remote repository and return its SHA"""
+        from fetch_modes import run
+        import subprocess
+
+        run('git commit -q --allow-empty -m "%s" && git push -q %s master' % (message, self.bare_path), self.work_path)
+        sha = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=self.work_path)
+        return sha.decode('utf-8').strip()
+
+    def test_clone_borrows_objects_of_mirror(self):
+        from gitautodeploy.wrappers.git import GitWrapper
+        import os
+
+        repo_config = self.create_repo_config('first')
+
+        self.assertEqual(GitWrapper.clone(repo_config), 0)
+        self.assertTrue(os.path.isdir(os.path.join(repo_config['mirror-path'], 'objects')))
+        self.assertTrue(os.path.isfile(os.path.join(repo_config['path'], 'data.bin')))
+
+        alternates = os.path.join(repo_config['path'], '.git', 'objects', 'info', 'alternates')
+        with open(alternates) as input:
+            self.assertIn(os.path.join(repo_config['mirror-path'], 'objects'), input.read())
+
+    def test_pull_updates_mirror_and_repositories(self):
+        from gitautodeploy.wrappers.git import GitWrapper
+        from gitautodeploy.events import EventStore, SystemEvent
+
+        first = self.create_repo_config('first')
+        second = self.create_repo_config('second')
+
+        self.assertEqual(GitWrapper.clone(first), 0)
+        self.assertEqual(GitWrapper.clone(second), 0)
+
+        sha = self.commit('Update')
+
+        event = SystemEvent()
+        EventStore(10).register_action(event)
+
+        self.assertEqual(GitWrapper.pull(first, commit_sha=sha, event=event), 0)
+        self.assertEqual(GitWrapper.read_ref(first['mirror-path'], 'refs/heads/master'), sha)
+        self.assertEqual(GitWrapper.get_head(first['path']), sha)
+
+        # The mirror already holds the commit, and is not fetched again
+        self.assertEqual(GitWrapper.pull(second, commit_sha=sha), 0)
+        self.assertEqual(GitWrapper.get_head(second['path']), sha)
+
+
+if __name__ == '__main__':
+    unittest.main()
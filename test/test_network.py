@@ -0,0 +1,152 @@
+import unittest
+from utils import UnitTestCaseBase
+
+
+class AddressAllowlistTestCase(UnitTestCaseBase):
+    """Tests of the CIDR address whitelist"""
+
+    def setUp(self):
+        import logging
+        super(AddressAllowlistTestCase, self).setUp()
+
+        # Invalid entries are logged as warnings
+        logging.getLogger().setLevel(logging.CRITICAL)
+
+    def create_allowlist(self, networks=None):
+        from gitautodeploy.models.network import AddressAllowlist
+        return AddressAllowlist(networks)
+
+    def write_file(self, data):
+        import os
+        import tempfile
+
+        handle, path = tempfile.mkstemp()
+        with os.fdopen(handle, 'w') as output:
+            output.write(data)
+
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_parse_network_masks_host_bits(self):
+        from gitautodeploy.models.network import parse_network
+
+        self.assertEqual(parse_network('192.30.252.17/22'), (4, 22, 0xc01efc00))
+        self.assertEqual(parse_network('10.0.0.1'), (4, 32, 0x0a000001))
+        self.assertEqual(parse_network('2001:db8::1/32'), (6, 32, 0x20010db8 << 96))
+
+    def test_parse_network_rejects_invalid_networks(self):
+        from gitautodeploy.models.network import parse_network
+
+        for network in ['github.com', '10.0.0.0/33', '10.0.0.0/-1', '2001:db8::/129', '10.0.0.256', '']:
+            self.assertRaises(ValueError, parse_network, network)
+
+    def test_address_in_network(self):
+        allowlist = self.create_allowlist(['192.30.252.0/22', '2001:db8::/32'])
+
+        self.assertIn('192.30.252.1', allowlist)
+        self.assertIn('192.30.255.255', allowlist)
+        self.assertNotIn('192.30.251.255', allowlist)
+        self.assertNotIn('192.31.0.1', allowlist)
+        self.assertIn('2001:db8:1::1', allowlist)
+        self.assertNotIn('2001:db9::1', allowlist)
+
+    def test_single_address_and_full_prefix(self):
+        allowlist = self.create_allowlist(['10.0.0.1', '10.0.0.2/32'])
+
+        self.assertIn('10.0.0.1', allowlist)
+        self.assertIn('10.0.0.2', allowlist)
+        self.assertNotIn('10.0.0.3', allowlist)
+
+    def test_zero_prefix_allows_all_addresses_of_family(self):
+        allowlist = self.create_allowlist(['0.0.0.0/0'])
+
+        self.assertIn('1.2.3.4', allowlist)
+        self.assertIn('255.255.255.255', allowlist)
+        self.assertNotIn('::1', allowlist)
+
+    def test_ipv4_mapped_ipv6(self):
+
+        # Clients connecting to a dual stack socket
+        allowlist = self.create_allowlist(['10.0.0.0/8'])
+        self.assertIn('::ffff:10.1.2.3', allowlist)
+        self.assertNotIn('::ffff:11.1.2.3', allowlist)
+
+        # Networks specified as mapped addresses
+        allowlist = self.create_allowlist(['::ffff:10.0.0.0/104'])
+        self.assertIn('10.1.2.3', allowlist)
+        self.assertIn('::ffff:10.1.2.3', allowlist)
+        self.assertNotIn('11.1.2.3', allowlist)
+
+    def test_zone_index_is_ignored(self):
+        allowlist = self.create_allowlist(['fe80::/10'])
+
+        self.assertIn('fe80::1%eth0', allowlist)
+        self.assertNotIn('fe00::1%eth0', allowlist)
+
+    def test_invalid_addresses_are_not_allowed(self):
+        allowlist = self.create_allowlist(['0.0.0.0/0', '::/0'])
+
+        self.assertNotIn('localhost', allowlist)
+        self.assertNotIn('', allowlist)
+
+    def test_invalid_entries_are_skipped(self):
+        allowlist = self.create_allowlist(['github.com', '10.0.0.0/33', '10.0.0.1'])
+
+        self.assertEqual(len(allowlist), 1)
+        self.assertIn('10.0.0.1', allowlist)
+
+    def test_only_invalid_entries_denies_all(self):
+        from gitautodeploy.cli.config import get_config_defaults, init_config
+
+        config = get_config_defaults()
+        config['webhook-whitelist'] = ['github.com']
+        config['web-ui-whitelist'] = ['localhost']
+        init_config(config)
+
+        self.assertEqual(len(config['webhook-allowlist']), 0)
+        self.assertNotIn('127.0.0.1', config['webhook-allowlist'])
+        self.assertNotIn('127.0.0.1', config['web-ui-allowlist'])
+
+    def test_load_github_meta(self):
+        import json
+
+        path = self.write_file(json.dumps({
+            'hooks': ['192.30.252.0/22', '2606:50c0::/32'],
+            'web': ['140.82.112.0/20']
+        }))
+
+        allowlist = self.create_allowlist()
+        allowlist.load(path)
+
+        self.assertEqual(len(allowlist), 2)
+        self.assertIn('192.30.252.10', allowlist)
+        self.assertIn('2606:50c0::1', allowlist)
+        self.assertNotIn('140.82.112.1', allowlist)
+
+    def test_load_json_list(self):
+        import json
+
+        allowlist = self.create_allowlist()
+        allowlist.load(self.write_file(json.dumps(['10.0.0.0/8'])))
+
+        self.assertIn('10.1.2.3', allowlist)
+
+    def test_load_plain_text(self):
+        path = self.write_file("# GitLab\n"
+                               "34.74.90.64/28  # hooks\n"
+                               "\n"
+                               "not-an-address\n"
+                               "2001:db8::1\n")
+
+        allowlist = self.create_allowlist(['10.0.0.1'])
+        allowlist.load(path)
+
+        self.assertEqual(len(allowlist), 3)
+        self.assertIn('34.74.90.70', allowlist)
+        self.assertNotIn('34.74.90.80', allowlist)
+        self.assertIn('2001:db8::1', allowlist)
+        self.assertIn('10.0.0.1', allowlist)
+
+
+if __name__ == '__main__':
+    unittest.main()
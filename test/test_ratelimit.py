@@ -0,0 +1,81 @@
+import unittest
+from utils import UnitTestCaseBase
+
+
+class RateLimiterTestCase(UnitTestCaseBase):
+    """Tests of the token bucket rate limiter, using a fake clock"""
+
+    def setUp(self):
+        import time
+        super(RateLimiterTestCase, self).setUp()
+
+        self.now = 1000.0
+        self._time = time.time
+        time.time = lambda: self.now
+
+    def tearDown(self):
+        import time
+        time.time = self._time
+
+    def create_limiter(self, rate=1, burst=3, max_keys=10000):
+        from gitautodeploy.ratelimit import RateLimiter
+        return RateLimiter(rate, burst, max_keys)
+
+    def test_burst_is_allowed_then_rejected(self):
+        limiter = self.create_limiter(rate=1, burst=3)
+
+        self.assertEqual([limiter.allow('a') for i in range(5)], [True, True, True, False, False])
+
+    def test_tokens_are_refilled_at_rate(self):
+        limiter = self.create_limiter(rate=2, burst=3)
+
+        for i in range(3):
+            limiter.allow('a')
+        self.assertFalse(limiter.allow('a'))
+
+        # Half a second refills one token
+        self.now += 0.5
+        self.assertTrue(limiter.allow('a'))
+        self.assertFalse(limiter.allow('a'))
+
+        # The bucket is never filled beyond the burst
+        self.now += 60
+        self.assertEqual([limiter.allow('a') for i in range(4)], [True, True, True, False])
+
+    def test_keys_are_limited_independently(self):
+        limiter = self.create_limiter(rate=1, burst=1)
+
+        self.assertTrue(limiter.allow('a'))
+        self.assertFalse(limiter.allow('a'))
+        self.assertTrue(limiter.allow('b'))
+
+    def test_idle_keys_are_forgotten(self):
+        limiter = self.create_limiter(rate=1, burst=1, max_keys=2)
+
+        limiter.allow('a')
+        limiter.allow('b')
+
+        # The bucket of a is full again, while the one of b is not
+        self.now += 1
+        limiter.allow('b')
+        limiter.allow('c')
+
+        self.assertEqual(sorted(limiter._buckets.keys()), ['b', 'c'])
+
+        # Keys that are still limited are kept
+        self.assertFalse(limiter.allow('b'))
+
+    def test_token_bucket_refill(self):
+        from gitautodeploy.ratelimit import TokenBucket
+
+        bucket = TokenBucket(rate=0.5, burst=2, now=0)
+        self.assertTrue(bucket.consume(0))
+        self.assertTrue(bucket.consume(0))
+        self.assertFalse(bucket.consume(1))
+        self.assertTrue(bucket.consume(2))
+        self.assertFalse(bucket.is_full(2))
+        self.assertTrue(bucket.is_full(6))
+
+
+if __name__ == '__main__':
+    unittest.main()
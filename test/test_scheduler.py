@@ -0,0 +1,191 @@
+import unittest
+from utils import UnitTestCaseBase
+
+
+class DeploySchedulerTestCase(UnitTestCaseBase):
+    """Tests of the deploy scheduler. Workers are dispatched to a list rather
+    than to threads, and run by the tests themselves, so that every
+    interleaving is deterministic."""
+
+    def setUp(self):
+        super(DeploySchedulerTestCase, self).setUp()
+
+        self.workers = []
+        self.calls = []
+        self.scheduler = self.create_scheduler()
+
+    def create_scheduler(self, **kwargs):
+        from gitautodeploy.scheduler import DeployScheduler
+        return DeployScheduler(dispatcher=self.dispatch, **kwargs)
+
+    def dispatch(self, target, *args):
+        self.workers.append((target, args))
+
+    def run_workers(self):
+        while self.workers:
+            target, args = self.workers.pop(0)
+            target(*args)
+
+    def create_project(self, path, url='https://github.com/olipo186/Git-Auto-Deploy.git'):
+        from gitautodeploy.models import Project
+        return Project({'url': url, 'path': path})
+
+    def deploy(self, name, cancellation=None):
+        self.calls.append(name)
+
+    def test_pushes_to_waiting_deploy_are_merged(self):
+        project = self.create_project('/tmp/a')
+        results = []
+
+        def deploy(name, cancellation=None):
+
+            # Pushes arriving while the first deploy is running
+            if name == 'first':
+                for push in ['second', 'third', 'fourth']:
+                    results.append(self.scheduler.submit(project, deploy, push))
+
+            self.calls.append(name)
+
+        self.assertTrue(self.scheduler.submit(project, deploy, 'first'))
+        self.run_workers()
+
+        # The waiting deploy is executed once, with the newest arguments
+        self.assertEqual(results, [True, False, False])
+        self.assertEqual(self.calls, ['first', 'fourth'])
+
+        stats = self.scheduler.get_stats()
+        self.assertEqual(stats['submitted'], 4)
+        self.assertEqual(stats['coalesced'], 2)
+        self.assertEqual(stats['completed'], 2)
+        self.assertEqual(stats['queue-depth'], 0)
+        self.assertEqual(stats['workers'], 0)
+
+    def test_pushes_before_start_are_merged(self):
+        project = self.create_project('/tmp/a')
+
+        self.assertTrue(self.scheduler.submit(project, self.deploy, 'first'))
+        self.assertFalse(self.scheduler.submit(project, self.deploy, 'second'))
+        self.run_workers()
+
+        self.assertEqual(self.calls, ['second'])
+
+    def test_deploys_of_same_project_are_serialized(self):
+        project = self.create_project('/tmp/a')
+        running = []
+
+        def deploy(name, cancellation=None):
+            running.append(name)
+            self.assertEqual(len(running), 1)
+
+            # A deploy submitted meanwhile is not started by its own worker
+            if name == 'first':
+                self.scheduler.submit(project, deploy, 'second')
+                self.run_workers()
+                self.assertEqual(self.calls, [])
+
+            running.remove(name)
+            self.calls.append(name)
+
+        self.scheduler.submit(project, deploy, 'first')
+        self.run_workers()
+
+        # It is handed off to the worker of the running deploy instead
+        self.assertEqual(self.calls, ['first', 'second'])
+        self.assertEqual(self.scheduler.get_stats()['workers'], 0)
+
+    def test_deploys_of_other_projects_run_concurrently(self):
+        first_project = self.create_project('/tmp/a')
+        second_project = self.create_project('/tmp/b')
+
+        def deploy(name, cancellation=None):
+            if name == 'first':
+                self.scheduler.submit(second_project, self.deploy, 'second')
+                self.run_workers()
+
+                # Started while the first deploy is still running
+                self.assertEqual(self.calls, ['second'])
+
+            self.calls.append(name)
+
+        self.scheduler.submit(first_project, deploy, 'first')
+        self.run_workers()
+
+        self.assertEqual(self.calls, ['second', 'first'])
+
+    def test_waiting_deploys_are_started_in_order(self):
+        projects = [self.create_project('/tmp/%s' % i) for i in range(3)]
+        self.scheduler = self.create_scheduler(max_workers=1)
+
+        for i, project in enumerate(projects):
+            self.scheduler.submit(project, self.deploy, i)
+
+        # A single worker executes all deploys
+        self.assertEqual(len(self.workers), 1)
+        self.run_workers()
+
+        self.assertEqual(self.calls, [0, 1, 2])
+
+    def test_failed_deploy_hands_off_to_next(self):
+        project = self.create_project('/tmp/a')
+
+        def fail(name, cancellation=None):
+            raise Exception("Deploy failed")
+
+        self.scheduler.submit(project, fail, 'first')
+        self.scheduler.submit(project, self.deploy, 'second')
+        self.run_workers()
+
+        self.assertEqual(self.calls, ['second'])
+
+        stats = self.scheduler.get_stats()
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(stats['completed'], 1)
+        self.assertEqual(stats['running'], 0)
+
+    def test_deploys_per_host_are_limited(self):
+        projects = [self.create_project('/tmp/%s' % i) for i in range(4)]
+        other_project = self.create_project('/tmp/other', url='https://gitlab.com/olipo186/Git-Auto-Deploy.git')
+        self.scheduler = self.create_scheduler(max_per_host=2)
+        running = []
+        observed = {}
+
+        # Exceptions raised by deploys are caught by the scheduler, so
+        # observations are recorded and verified afterwards
+        def deploy(name, cancellation=None):
+            if name != 'other':
+                running.append(name)
+                observed['max-running'] = max(observed.get('max-running', 0), len(running))
+
+            # The other deploys are submitted while two are running
+            if name == 0:
+                self.scheduler.submit(projects[1], deploy, 1)
+                self.run_workers()
+            elif name == 1:
+                self.scheduler.submit(projects[2], deploy, 2)
+                self.scheduler.submit(projects[3], deploy, 3)
+                self.scheduler.submit(other_project, deploy, 'other')
+                self.run_workers()
+                observed['calls'] = list(self.calls)
+                observed['queue-depth'] = self.scheduler.get_stats()['queue-depth']
+
+            if name != 'other':
+                running.remove(name)
+            self.calls.append(name)
+
+        self.scheduler.submit(projects[0], deploy, 0)
+        self.run_workers()
+
+        # Deploys from other hosts are not held back, while the extra deploys
+        # wait until a slot is freed
+        self.assertEqual(observed['max-running'], 2)
+        self.assertEqual(observed['calls'], ['other'])
+        self.assertEqual(observed['queue-depth'], 2)
+        self.assertEqual(self.calls, ['other', 1, 2, 3, 0])
+
+        stats = self.scheduler.get_stats()
+        self.assertEqual(stats['completed'], 5)
+        self.assertEqual(stats['queue-depth'], 0)
+        self.assertEqual(stats['workers'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,11 +5,10 @@ class WebhookTestCaseBase(unittest.TestCase):
     thread = None
 
     def setUp(self):
-        import sys
 
         # Use our custom importer to replace certain modules with stub modules to
         # enable testing of other parts of GAD
-        sys.meta_path.append(StubImporter())
+        install_stub_importer()
 
     def start_gad(self, test_config):
         import sys
@@ -55,6 +54,30 @@ class WebhookTestCaseBase(unittest.TestCase):
         pass
 
 
+class UnitTestCaseBase(unittest.TestCase):
+    """Base class for unit tests of GAD modules. Wrapper modules are replaced
+    by their stubs, so no git or shell commands are run."""
+
+    def setUp(self):
+        import sys
+        import os
+
+        install_stub_importer()
+
+        # Add repo root to sys path
+        repo_root = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+        if repo_root not in sys.path:
+            sys.path.insert(1, repo_root)
+
+
+def install_stub_importer():
+    """Install the stub importer, unless a previous test already did"""
+    import sys
+
+    if not any(isinstance(importer, StubImporter) for importer in sys.meta_path):
+        sys.meta_path.append(StubImporter())
+
+
 class StubImporter(object):
 
     overload_modules = ['gitautodeploy.wrappers.git', 'gitautodeploy.wrappers.process']
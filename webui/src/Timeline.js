@@ -199,13 +199,67 @@ class Timeline extends Component {
   authenticateWebsocketConnection(authKey) {
     var self = this;
 
-    // Authenticate
+    // Authenticate, and ask for change records rather than whole events
     self.wsSocket.send(JSON.stringify({
       "type": "authenticate",
-      "auth-key": self.state.wsAuthKey
+      "auth-key": self.state.wsAuthKey,
+      "delta-updates": true
     }));
   }
 
+  fetchEvent(id) {
+    var self = this;
+
+    axios.get(this.state.host + '/api/events/' + id)
+      .then(function(res) {
+        self.addOrUpdateEvent(new Event(res.data));
+      })
+      .catch(err => {
+        console.warn(err);
+      });
+  }
+
+  applyEventChange(change) {
+    var self = this;
+    var outOfSequence = false;
+
+    this.setState((prevState, props) => {
+
+      var newEvents = prevState.events.map(curEvent => {
+
+        if(curEvent.id !== change.id)
+          return curEvent;
+
+        // Already included in the event
+        if(change.sequence <= curEvent.sequence)
+          return curEvent;
+
+        // A change was missed, the whole event needs to be fetched
+        if(change.sequence !== curEvent.sequence + 1) {
+          outOfSequence = true;
+          return curEvent;
+        }
+
+        var data = Object.assign({}, curEvent.event, change.fields, {sequence: change.sequence});
+
+        if(change.type === "message-appended") {
+          data.messages = curEvent.event.messages.concat([change.message]);
+        }
+
+        return new Event(data);
+      });
+
+      return {
+        events: newEvents
+      }
+
+    }, function() {
+      if(outOfSequence || !self.getEventWithId(change.id)) {
+        self.fetchEvent(change.id);
+      }
+    });
+  }
+
   handleJSONMessage(data) {
     var event;
     var self = this;
@@ -242,6 +296,10 @@ class Timeline extends Component {
       event = new Event(data.event);
       this.addOrUpdateEvent(event);
 
+    } else if(data.type === "message-appended" || data.type === "status-changed" || data.type === "field-changed") {
+
+      this.applyEventChange(data);
+
     } else if(data.type === "event-success") {
 
       event = this.getEventWithId(data.id);